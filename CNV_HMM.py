@@ -0,0 +1,280 @@
+##############################################################
+#
+# CNV_HMM.py
+#
+# Call deletions with a copy-number hidden Markov model
+# (deletion / normal / amplification) instead of a fixed
+# cut-off: every progeny is decoded with Viterbi, chromosome by
+# chromosome, all chromosomes of a block of progenies at once
+# in numpy.
+# The deleted runs are then counted as in Method1, and the
+# output is written to deletion_windows.txt, which the gene and
+# core steps of Method1 read.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import argparse, os, sys
+
+import numpy as np
+
+import bin_reader, metrics
+from find_deletion_windows import read_data, count_runs, combine_deletes, write_in_file, write_in_table
+from intervals import parse_region
+
+# The states, and the copy ratio (value over the progeny's median) expected in each.
+STATES = ('deletion', 'normal', 'amplification')
+DELETION, NORMAL, AMPLIFICATION = range(3)
+RATIOS = (0.0, 1.0, 2.0)
+
+# The log-likelihood ratio of a window between two states is capped at EVIDENCE, so a lone zero or spike
+# cannot flip the state on its own: with the default --switch, a deletion needs three windows of strong evidence.
+EVIDENCE = 8.0
+
+# Windows taken to find the median and spread of every progeny.
+SAMPLE_WINDOWS = 2048
+
+# Windows decoded at once get their emissions computed together.
+STEP_BLOCK = 64
+
+# Progenies decoded at once. The back-pointers and states take a byte per window of each of them.
+PROGENY_BLOCK = 256
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Take data files to find potential deletion windows with a copy-number HMM.')
+    parser.add_argument('data_file', help='an input data file', nargs = '+')
+    parser.add_argument('--low_bound', '-l', type=int, required = False, default=3, help='Only returns results of at least LOW_BOUND consecutive windows. Default = 3')
+    parser.add_argument('--interval', '-i', type=int, required = False, nargs = 2, default=[10, 40], help='Only considers windows with numbers of deletions within the interval. Default = [10, 40]. Example input: 10 40')
+    parser.add_argument('--switch', type=float, required = False, default=1e-4, help='Probability of going from a state to each other state between two windows. Default = 0.0001')
+    parser.add_argument('--deletion_mean', type=float, required = False, default=0.05, help='Mean copy ratio (value over the progeny median) of deleted windows. Default = 0.05')
+    parser.add_argument('--jobs', '-j', type=int, required = False, default=1, help='Number of processes that read the data files. Default = 1')
+    parser.add_argument('--prefetch', type=int, required = False, default=bin_reader.PREFETCH_FILES, help='With one job, number of data files read at once in background threads while they are parsed in order. 0 reads them in turn. Default = {0}'.format(bin_reader.PREFETCH_FILES))
+    parser.add_argument('--region', '--chrom', type=parse_region, required = False, help='Only reads and decodes the windows overlapping REGION, written CHROM or CHROM:BEGIN-END, for example Pf3D7_05_v3:100000-120000')
+    parser.add_argument('--columnar', action='store_true', required = False, help='Write deletion_windows.npz, a table with one typed column per field, instead of deletion_windows.txt')
+    metrics.add_arguments(parser)
+
+    args = parser.parse_args()
+    for path in args.data_file:
+        if not os.path.isfile(path):
+            parser.error('File "{0}" cannot be found.'.format(path))
+    if not 0 < args.switch < 0.5:
+        parser.error('--switch must be between 0 and 0.5.')
+    if not 0 < args.deletion_mean < 1:
+        parser.error('--deletion_mean must be between 0 and 1.')
+
+    return args
+
+
+def chromosome_order(chroms, positions):
+
+    # (order, offsets, lengths): the rows sorted by chromosome and window location, and where each chromosome
+    # begins in that order and its number of windows.
+    order = np.lexsort((positions, chroms))
+    codes, offsets, lengths = np.unique(chroms[order], return_index=True, return_counts=True)
+
+    return (order, offsets, lengths)
+
+
+def progeny_scales(data):
+
+    # (medians, sigmas): the median of every progeny, taken as its normal copy ratio, and the spread of its
+    # log copy ratios, from the quartiles. Up to SAMPLE_WINDOWS evenly spaced windows are enough for them.
+    sample = np.ascontiguousarray(data[::max(1, data.shape[0]//SAMPLE_WINDOWS)].T)
+    win_num = sample.shape[1]
+    ranks = [(win_num-1)//4, (win_num-1)//2, 3*(win_num-1)//4]
+    quartiles = np.partition(sample, ranks, axis=1)[:, ranks].T.astype(np.float64)
+
+    medians = np.where(quartiles[1] > 0, quartiles[1], 1.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigmas = (np.log(quartiles[2])-np.log(quartiles[0]))/1.349
+    sigmas = np.where(np.isfinite(sigmas) & (sigmas > 0.05), sigmas, 0.05)
+
+    return (medians, sigmas)
+
+
+def emissions(values, medians, sigmas, deletion_mean, scores):
+
+    # Fills SCORES (steps x states x chains, the normal row left at 0) with the log-likelihood of VALUES
+    # (steps x chains) in each state less that of the normal state: an exponential of mean DELETION_MEAN for
+    # deleted windows, log-normal around the state's copy ratio otherwise, each capped at EVIDENCE either way.
+    ratios = np.multiply(values, (1/medians).astype(np.float32))
+    np.maximum(ratios, np.float32(1e-6), out=ratios)
+    log_ratios = np.log(ratios)
+    half_precision = (0.5/sigmas**2).astype(np.float32)
+    log_two = np.log(RATIOS[AMPLIFICATION])
+
+    deletion = scores[:values.shape[0], DELETION]
+    np.multiply(log_ratios, log_ratios, out=deletion)
+    deletion *= half_precision
+    deletion += log_ratios
+    ratios *= np.float32(1/deletion_mean)
+    deletion -= ratios
+    deletion += (np.log(sigmas*np.sqrt(2*np.pi))-np.log(deletion_mean)).astype(np.float32)
+    np.clip(deletion, -EVIDENCE, EVIDENCE, out=deletion)
+
+    amplification = scores[:values.shape[0], AMPLIFICATION]
+    np.multiply(log_ratios, (2*log_two)*half_precision, out=amplification)
+    amplification -= (log_two**2)*half_precision
+    np.clip(amplification, -EVIDENCE, EVIDENCE, out=amplification)
+
+
+def viterbi(data, offsets, lengths, switch, deletion_mean):
+
+    # Decodes the rows of DATA (sorted by chromosome, each chromosome at OFFSETS with LENGTHS windows) of every
+    # progeny. Each chain (a chromosome of a progeny) is decoded on its own, but all chains step together,
+    # so the loop runs over the windows of the longest chromosome only.
+    # Returns states structure:
+    # step -> chain (chromosome*progenies+progeny) -> state, only meaningful below the chain's length
+    pro_num = data.shape[1]
+    chain_num = lengths.size*pro_num
+    step_num = int(lengths.max()) if lengths.size else 0
+    medians, sigmas = progeny_scales(data)
+    medians = np.tile(medians, lengths.size)
+    sigmas = np.tile(sigmas, lengths.size)
+    ends = {}
+    for chrom, length in enumerate(lengths.tolist()):
+        ends.setdefault(length-1, []).append(chrom)
+
+    # Scores are kept less the best one of the chain, and staying costs nothing, so moving costs MOVE.
+    move = np.float32(np.log(switch)-np.log(1-2*switch))
+
+    # back: step -> chain -> how the best paths got there, packed in a byte: bits 0-1 hold the best state at
+    # the step before, and bit 2+STATE is set where the best path to STATE came from the same state instead.
+    back = np.empty((step_num, chain_num), dtype=np.uint8)
+    final = np.empty((3, chain_num), dtype=np.float32)
+    delta = np.zeros((3, chain_num), dtype=np.float32)
+    delta[[DELETION, AMPLIFICATION]] = move
+    below_first = np.empty(chain_num, dtype=bool)
+    below_second = np.empty(chain_num, dtype=bool)
+    stayed = np.empty(chain_num, dtype=bool)
+    bits = np.empty(chain_num, dtype=np.uint8)
+    scores = np.zeros((STEP_BLOCK, 3, chain_num), dtype=np.float32)
+    block_values = np.empty((STEP_BLOCK, chain_num), dtype=np.float32)
+
+    for first in range(0, step_num, STEP_BLOCK):
+        last = min(first+STEP_BLOCK, step_num)
+
+        # Steps past the end of a chromosome take the median and are not used.
+        values = block_values[:last-first]
+        for chrom, (offset, length) in enumerate(zip(offsets.tolist(), lengths.tolist())):
+            columns = slice(chrom*pro_num, (chrom+1)*pro_num)
+            kept = max(0, min(last, length)-first)
+            values[:kept, columns] = data[offset+first:offset+first+kept]
+            values[kept:, columns] = medians[columns]
+        emissions(values, medians, sigmas, deletion_mean, scores)
+
+        for step in range(first, last):
+            top = delta.max(axis=0)
+            np.less(delta[0], top, out=below_first)
+            np.less(delta[1], top, out=below_second)
+            below_second &= below_first
+            row = back[step]
+            np.add(below_first.view(np.uint8), below_second.view(np.uint8), out=row)
+            delta -= top
+            for state in range(3):
+                np.greater_equal(delta[state], move, out=stayed)
+                np.left_shift(stayed.view(np.uint8), state+2, out=bits)
+                row |= bits
+            np.maximum(delta, move, out=delta)
+            delta += scores[step-first]
+            for chrom in ends.get(step, []):
+                final[:, chrom*pro_num:(chrom+1)*pro_num] = delta[:, chrom*pro_num:(chrom+1)*pro_num]
+
+    # Paths stay put past the end of their chromosome, so all chains are traced back together.
+    for chrom, length in enumerate(lengths.tolist()):
+        back[length:, chrom*pro_num:(chrom+1)*pro_num] = 0b11100
+
+    states = np.empty((step_num, chain_num), dtype=np.uint8)
+    current = final.argmax(axis=0).astype(np.uint8)
+    for step in range(step_num-1, -1, -1):
+        states[step] = current
+        np.add(current, 2, out=bits)
+        np.right_shift(back[step], bits, out=bits)
+        bits &= 1
+        np.copyto(current, back[step] & 3, where=~bits.view(bool))
+
+    return states
+
+
+def deleted_runs(states, offsets, lengths, pro_num):
+
+    # (pros, begins, ends) of every run of deleted windows, in rows of the sorted data, ordered by progeny
+    # and then by begin window, as find_deletion_windows.find_runs gives them.
+    step_num, chain_num = states.shape
+    deleted = np.zeros((step_num+2, chain_num), dtype=np.int8)
+    np.equal(states, DELETION, out=deleted[1:-1].view(bool))
+    for chrom, length in enumerate(lengths.tolist()):
+        deleted[length+1:, chrom*pro_num:(chrom+1)*pro_num] = 0
+    edges = np.diff(deleted, axis=0)
+
+    begins, begin_chains = np.nonzero(edges == 1)
+    ends, end_chains = np.nonzero(edges == -1)
+    begin_order = np.lexsort((begins, begin_chains))
+    end_order = np.lexsort((ends, end_chains))
+    chains = begin_chains[begin_order]
+    row_offsets = offsets[chains//pro_num]
+    pros = chains % pro_num
+    begins = begins[begin_order]+row_offsets
+    ends = ends[end_order]-1+row_offsets
+
+    order = np.lexsort((begins, pros))
+    return (pros[order], begins[order], ends[order])
+
+
+def find_deletes(data, chroms, positions, chrom_names, low_bound, interval, switch=1e-4, deletion_mean=0.05, stats=metrics.NULL):
+
+    # Data files sorted by chromosome and window need no copy.
+    order, offsets, lengths = chromosome_order(chroms, positions)
+    if (np.diff(order) != 1).any():
+        data = data[order]
+        chroms = chroms[order]
+        positions = positions[order]
+
+    # Progenies are decoded PROGENY_BLOCK at a time, so the states of every window are only kept for one block,
+    # whatever the number of progenies. The runs of each block are ordered, and the blocks follow each other.
+    runs = []
+    for block in range(0, data.shape[1], PROGENY_BLOCK):
+        columns = data[:, block:block+PROGENY_BLOCK]
+        with stats.stage('viterbi'):
+            states = viterbi(columns, offsets, lengths, switch, deletion_mean)
+        with stats.stage('count_runs'):
+            pros, begins, ends = deleted_runs(states, offsets, lengths, columns.shape[1])
+            runs.append((pros+block, begins, ends))
+        del states
+
+    with stats.stage('count_runs'):
+        if runs:
+            pros, begins, ends = [np.concatenate(part) for part in zip(*runs)]
+        else:
+            pros = begins = ends = np.empty(0, dtype=np.int64)
+        keys, first, counts = count_runs(begins, ends, chroms.size, low_bound)
+    stats.count('runs_found', begins.size)
+    stats.count('intervals_counted', keys.size)
+
+    return combine_deletes(keys, first, counts, chroms.size, chroms, positions, chrom_names, interval)
+
+
+# Main flow
+if __name__ == '__main__':
+    args = parse_args()
+    stats = metrics.from_args(args)
+
+    with stats.stage('read_data'):
+        data, chroms, positions, chrom_names = read_data(args.data_file, args.jobs, None, bin_reader.bin_region(args.region), stats, 'float32', args.prefetch)
+    if not data.shape[0]:
+        sys.stderr.write('Error: No windows to decode.\n')
+        sys.exit(1)
+    stats.count('windows_kept', data.shape[0])
+    stats.count('progenies', data.shape[1])
+
+    deletes = find_deletes(data, chroms, positions, chrom_names, args.low_bound, args.interval, args.switch, args.deletion_mean, stats)
+    stats.count('deletion_windows', len(deletes))
+
+    with stats.stage('write_in_file'):
+        if args.columnar:
+            write_in_table(deletes)
+        else:
+            write_in_file(deletes)
+    stats.write()
@@ -17,16 +17,34 @@
 
 
 
-import argparse, os, sys
+import argparse, os, heapq
+import multiprocessing
 from collections import defaultdict
 
+import numpy as np
+
+import bin_reader, bitsets, metrics
+from intervals import parse_region
+
 def parse_args():
 
     parser = argparse.ArgumentParser(description='Takes a data file and finds windows of potential deletes. Output is printed to stdout.')
     parser.add_argument('file', help='an input data file', nargs='+')
     parser.add_argument('--low_bound', '-l', type=int, default = 5, help='only return windows that have at least LOW_BOUND zeros')
+    parser.add_argument('--stream', '-s', action='store_true', help='read the files line by line and merge them in sorted order, keeping memory flat. Every file must be sorted by chromosome and window')
+    parser.add_argument('--jobs', '-j', type=int, default = 1, help='number of processes that read the files')
+    parser.add_argument('--prefetch', type=int, default = bin_reader.PREFETCH_FILES, help='without --jobs, number of files read at once in background threads while they are parsed in order (with --stream every file is read one block ahead). 0 reads them in turn. Default = {0}'.format(bin_reader.PREFETCH_FILES))
+    parser.add_argument('--packed', '-p', action='store_true', help='keep the zero calls as a bit matrix, one bit per progeny and window, and count them from it')
+    parser.add_argument('--bits', '-b', help='also write the zero calls to BITS, a bit matrix that query_deletions.py reads. Implies --packed')
+    parser.add_argument('--region', '--chrom', type=parse_region, help='only read the windows overlapping REGION, written CHROM or CHROM:BEGIN-END, for example Pf3D7_05_v3:100000-120000')
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
+    if args.stream and args.jobs > 1:
+        parser.error('--stream and --jobs cannot be used together.')
+    args.packed = args.packed or bool(args.bits)
+    if args.stream and args.packed:
+        parser.error('--stream and --packed (or --bits) cannot be used together.')
     for path in list(args.file):
         if not os.path.isfile(path):
             parser.error('File "{0}" cannot be found.'.format(path))
@@ -34,50 +52,253 @@ def parse_args():
     
     return args
 
-def find_windows(file_paths):
+def map_jobs(function, items, jobs):
+
+    # Results come back in the order of ITEMS, whatever the number of jobs.
+    if jobs <= 1 or len(items) <= 1:
+        return [function(*item) for item in items]
+
+    with multiprocessing.Pool(min(jobs, len(items))) as pool:
+        return pool.starmap(function, items, chunksize=1)
+
+
+def zero_counts(path, region=None, chunks=None):
+
+    # Yields (chromosome, window location, count of zeros) for every line of the file, a block of lines at a time
+    # (from CHUNKS if given).
+    if chunks is None:
+        chunks = bin_reader.read_chunks(path, region)
+    for chunk in chunks:
+        names, counts = bin_reader.count_zero_words(chunk)
+
+        if not all(name.startswith('Pf3D7') for name in names):
+            raise ValueError('Error in "{0}": Unexpected data format.'.format(path))
+        bins = bin_reader.decode_bins(names)
+        if bins is None:
+            raise ValueError('Error in "{0}": Unexpected data format.'.format(path))
+
+        chrom_names, codes, nums = bins
+        for code, num, count in zip(codes.tolist(), nums.tolist(), counts.tolist()):
+            yield (chrom_names[code], num*300, count)
+
+
+def count_zeros(path, region=None, chunks=None):
 
     # windows struction:
     # 1st dict key: chromosome -> 2nd dict key: window location -> count of zeros
-    windows = defaultdict(lambda:defaultdict(int))
-    for path in file_paths:
-        file =  open(path, 'r')
-        file.readline()
+    windows = defaultdict(dict)
+    for chrom, pos, count in zero_counts(path, region, chunks):
+        windows[chrom][pos] = count
 
-        for line in file:
-            split_line = line.split()
-            
-            if not split_line[0].startswith('Pf3D7'):
-                sys.stderr.write('Error in "{0}": Unexpected data format.\n'.format(path))
-                sys.exit(1)
-            loc = split_line[0].split('_')
-            chrom = loc[0]+'_'+loc[1]+'_'+loc[2]
-            pos = int(loc[-1])*300
-            count = 0
-            for num in split_line[1:]:
-                if num == '0':
-                    count += 1
-			
-            windows[chrom][pos] = count
-    file.close()
+    return dict(windows)
+
+
+def read_parts(function, file_paths, jobs=1, region=None, prefetch=bin_reader.PREFETCH_FILES):
+
+    # FUNCTION of every file, in the given order. With one job the next files are read in background
+    # threads (PREFETCH files at once) while one is parsed. FUNCTION raises ValueError on a malformed file,
+    # which stops the run here whatever process it came from.
+    with bin_reader.exit_on_error():
+        if jobs <= 1 or len(file_paths) <= 1:
+            return [function(path, region, chunks) for path, chunks in bin_reader.read_files(file_paths, region, prefetch)]
+
+        return map_jobs(function, [(path, region) for path in file_paths], jobs)
+
+
+def find_windows(file_paths, jobs=1, region=None, stats=metrics.NULL, prefetch=bin_reader.PREFETCH_FILES):
+
+    # windows struction:
+    # 1st dict key: chromosome -> 2nd dict key: window location -> count of zeros
+    # Files are merged in the given order, so a window found in several files keeps the count of the last one.
+    windows = defaultdict(lambda:defaultdict(int))
+    for part in read_parts(count_zeros, file_paths, jobs, region, prefetch):
+        stats.count('lines_parsed', sum(len(part[chrom]) for chrom in part))
+        for chrom in part:
+            windows[chrom].update(part[chrom])
             
     return windows
 
 
-def find_deletions(file_paths, low_bound):
+def zero_matrix(path, region=None, chunks=None):
+
+    # Returns (chrom_names, chroms, positions, blocks, width, progenies), the blocks of zero calls of the file:
+    # chrom_names: chromosomes in the order they first appear -> chroms: index into chrom_names of each row
+    # positions: window location of each row -> blocks: one packed row per window, one bit per progeny, set where the value is zero
+    # width: the most progenies of a row -> progenies: names from the header line
+    file = bin_reader.open_bin_file(path)
+    progenies = file.readline().split()[1:]
+    file.close()
+
+    chrom_names = []
+    chroms = []
+    positions = []
+    blocks = []
+    width = 0
+    if chunks is None:
+        chunks = bin_reader.read_chunks(path, region)
+    for chunk in chunks:
+        names, bits, chunk_width = bin_reader.zero_bits(chunk)
+
+        if not all(name.startswith('Pf3D7') for name in names):
+            raise ValueError('Error in "{0}": Unexpected data format.'.format(path))
+        bins = bin_reader.decode_bins(names)
+        if bins is None:
+            raise ValueError('Error in "{0}": Unexpected data format.'.format(path))
+
+        for chrom in bins[0]:
+            if chrom not in chrom_names:
+                chrom_names.append(chrom)
+        chroms.append(np.array([chrom_names.index(chrom) for chrom in bins[0]], dtype=np.uint16)[bins[1]])
+        positions.append(bins[2]*300)
+        blocks.append(bits)
+        width = max(width, chunk_width)
+
+    return (chrom_names, chroms, positions, blocks, width, progenies)
+
+
+def find_zero_matrix(file_paths, jobs=1, region=None, stats=metrics.NULL, prefetch=bin_reader.PREFETCH_FILES):
 
-    windows = find_windows(file_paths)
+    # The zero calls of the files, merged into a bitsets.Bit_matrix with a row per window, sorted by chromosome
+    # and window. As in find_windows, a window found in several files keeps the row of the last one.
+    parts = read_parts(zero_matrix, file_paths, jobs, region, prefetch)
 
-    file = open('data.map', 'w')
+    chrom_names = sorted(set(chrom for part in parts for chrom in part[0]))
+    chroms = []
+    positions = []
+    blocks = []
+    for part_names, part_chroms, part_positions, part_blocks, width, progenies in parts:
+        codes = np.array([chrom_names.index(chrom) for chrom in part_names], dtype=np.uint16)
+        chroms.extend(codes[block] for block in part_chroms)
+        positions.extend(part_positions)
+        blocks.extend(part_blocks)
 
-    for chrom in sorted(windows.keys()):
-        for pos in sorted(windows[chrom].keys()):
-            if windows[chrom][pos] > low_bound:
-                file.write(chrom+'\t'+str(pos)+'\n')
+    # The progenies are named by the longest header, and columns beyond it by number.
+    width = max([part[4] for part in parts]+[0])
+    progenies = max([part[5] for part in parts], key=len) if parts else []
+    progenies = progenies[:width]+['column_{0}'.format(column+1) for column in range(len(progenies), width)]
+
+    if not blocks:
+        return bitsets.Bit_matrix(chrom_names, [], [], np.empty((0, (width+7)//8), dtype=np.uint8), progenies)
+
+    # Rows of files with fewer progenies are padded with unset bits.
+    bits = np.zeros((sum(block.shape[0] for block in blocks), (width+7)//8), dtype=np.uint8)
+    row = 0
+    for block in blocks:
+        bits[row:row+block.shape[0], :block.shape[1]] = block
+        row += block.shape[0]
+    chroms = np.concatenate(chroms)
+    positions = np.concatenate(positions)
+    stats.count('lines_parsed', chroms.size)
+
+    # The last row of each window, in order of chromosome and window.
+    order = np.lexsort((np.arange(chroms.size), positions, chroms))
+    last = np.ones(order.size, dtype=bool)
+    last[:-1] = (chroms[order][1:] != chroms[order][:-1]) | (positions[order][1:] != positions[order][:-1])
+    order = order[last]
+
+    return bitsets.Bit_matrix(chrom_names, chroms[order], positions[order], bits[order], progenies)
+
+
+def packed_windows(matrix, low_bound):
+
+    # Yields (chromosome, window location) of every window of the zero matrix with more than LOW_BOUND zeros.
+    for row in matrix.windows_with(low_bound+1).tolist():
+        yield matrix.window(row)
+
+
+def select_windows(counts, low_bound):
+
+    return [pos for pos in sorted(counts.keys()) if counts[pos] > low_bound]
+
+
+def read_windows(path, region=None, chunks=None):
+
+    # Yields (chromosome, window location, count of zeros) for every line of the file, checking that they come sorted.
+    last = None
+    for chrom, pos, count in zero_counts(path, region, chunks):
+        if last is not None and (chrom, pos) <= last:
+            raise ValueError('Error in "{0}": Windows are not sorted, run without --stream.'.format(path))
+        last = (chrom, pos)
+
+        yield (chrom, pos, count)
+
+
+def tag_windows(n, path, region=None, chunks=None):
+
+    for chrom, pos, count in read_windows(path, region, chunks):
+        yield (chrom, pos, n, count)
+
+
+def stream_windows(file_paths, region=None, stats=metrics.NULL, prefetch=bin_reader.PREFETCH_FILES):
+
+    # Merge the sorted files into one sorted stream. The file index breaks ties, so when several files
+    # hold the same window the last one wins, as in find_windows.
+    # Unless PREFETCH is 0, every file is read in a background thread one block of lines ahead, so memory stays flat.
+    chunks = [bin_reader.Prefetch(bin_reader.read_chunks(path, region), 1) if prefetch > 0 else None for path in file_paths]
+    merged = stats.counted('lines_parsed', heapq.merge(*[tag_windows(n, path, region, chunks[n]) for n, path in enumerate(file_paths)]))
+
+    last = None
+    with bin_reader.exit_on_error():
+        for window in merged:
+            if last is not None and window[:2] != last[:2]:
+                yield (last[0], last[1], last[3])
+            last = window
+    if last is not None:
+        yield (last[0], last[1], last[3])
+
+
+def deletion_windows(file_paths, low_bound, stream=False, jobs=1, region=None, stats=metrics.NULL, packed=False, prefetch=bin_reader.PREFETCH_FILES):
+
+    # Yields (chromosome, window location) of every window with more than LOW_BOUND zeros, in sorted order.
+    if packed:
+        for window in packed_windows(find_zero_matrix(file_paths, jobs, region, stats, prefetch), low_bound):
+            yield window
+    elif stream:
+        for chrom, pos, count in stream_windows(file_paths, region, stats, prefetch):
+            if count > low_bound:
+                yield (chrom, pos)
+    else:
+        windows = find_windows(file_paths, jobs, region, stats, prefetch)
+
+        # Each chromosome is sorted and filtered on its own, then returned in chromosome order. Sorting a few thousand
+        # windows costs less than sending them to a worker, so it is done here.
+        for chrom in sorted(windows.keys()):
+            for pos in select_windows(windows[chrom], low_bound):
+                yield (chrom, pos)
+
+
+def write_deletions(windows, file_path='data.map'):
+
+    file = open(file_path, 'w')
+
+    for chrom, pos in windows:
+        file.write(chrom+'\t'+str(pos)+'\n')
 
     file.close()
 
+
+def find_deletions(file_paths, low_bound, stream=False, jobs=1, region=None):
+
+    write_deletions(deletion_windows(file_paths, low_bound, stream, jobs, region))
+
 # Main flow
+if __name__ == '__main__':
+    args = parse_args()
+    stats = metrics.from_args(args)
 
-args = parse_args()
+    # With --stream the windows are read while they are written, so the reading is part of write_deletions.
+    if args.stream:
+        windows = deletion_windows(args.file, args.low_bound, args.stream, args.jobs, bin_reader.bin_region(args.region), stats, False, args.prefetch)
+    elif args.bits:
+        with stats.stage('find_windows'):
+            matrix = find_zero_matrix(args.file, args.jobs, bin_reader.bin_region(args.region), stats, args.prefetch)
+            windows = list(packed_windows(matrix, args.low_bound))
+        with stats.stage('write_bits'):
+            matrix.save(args.bits)
+    else:
+        with stats.stage('find_windows'):
+            windows = list(deletion_windows(args.file, args.low_bound, False, args.jobs, bin_reader.bin_region(args.region), stats, args.packed, args.prefetch))
 
-find_deletions(args.file, args.low_bound)      
+    with stats.stage('write_deletions'):
+        write_deletions(stats.counted('windows_kept', windows))
+    stats.write()
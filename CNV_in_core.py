@@ -14,8 +14,12 @@
 #
 ######################################################
 
-import argparse
-from collections import defaultdict
+import argparse, itertools
+
+import numpy as np
+
+import metrics
+from intervals import Interval_index, parse_region, in_region, widen_region
 
 def parse_args():
     
@@ -23,17 +27,23 @@ def parse_args():
 
     parser.add_argument('core_file')
     parser.add_argument('file_path', help='an input data file', nargs='+')
+    parser.add_argument('--region', type=parse_region, help='only look at the windows and core regions overlapping REGION, written CHROM or CHROM:BEGIN-END, for example Pf3D7_05_v3:100000-120000')
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
 
     return args
 
 
-def read_cores(path):
+def read_cores(path, region=None):
     
     # cores struction:
-    # 1st dict key: chromosome -> [start pos, end pos, all information]
-    cores = defaultdict(lambda: [])
+    # Interval_index over all the core regions -> core number
+    # core_lines: core number -> all information
+    chroms = []
+    starts = []
+    ends = []
+    core_lines = []
 
     with open(path, 'r') as core_file:
         line = core_file.readline().rstrip()
@@ -42,51 +52,95 @@ def read_cores(path):
 
             split_line = line.split(' ')
 
-            chrom = split_line[0]
-            start = int(split_line[1])
-            end = int(split_line[2])
-
-            cores[chrom].append([start, end, line])
+            if in_region(region, split_line[0], int(split_line[1]), int(split_line[2])):
+                chroms.append(split_line[0])
+                starts.append(int(split_line[1]))
+                ends.append(int(split_line[2]))
+                core_lines.append(line)
             line = core_file.readline()
         
-    return cores
+    return (Interval_index(chroms, starts, ends), core_lines)
 
 
-def in_core(file_path, cores):
-    old_file = open(file_path, 'r')
+def search_cores(windows, cores):
 
-    new_file = open(file_path+'.core', 'w', 1)
+    # Takes (chromosome, window location) pairs sorted by chromosome and returns, for each window,
+    # the number of the first core region in the order of the core file that holds either its begin
+    # or its end (pos+300), or -1 if none does.
+    index, core_lines = cores
+    found = []
 
-    line = old_file.readline().rstrip()
+    # The windows of a chromosome are looked up together.
+    for chrom, group in itertools.groupby(windows, key=lambda window: window[0]):
+        pos = np.array([window[1] for window in group], dtype=np.int64)
 
-    while line != '':
+        at_begin = index.first(chrom, pos, pos)
+        at_end = index.first(chrom, pos+300, pos+300)
+        found.extend(np.where((at_begin < 0) | ((at_end >= 0) & (at_end < at_begin)), at_end, at_begin).tolist())
 
-        split_line = line.split('\t')
+    return found
 
-        chrom = split_line[0]
-        pos = int(split_line[1])
-        found = False
 
-        if chrom in cores:
-            for core in cores[chrom]:
-                if core[0] <= pos <= core[1] or core[0] <= pos+300 <= core[1]:
-                    found = True
-                    new_file.write(line+'\t'+core[2].rstrip()+'\n')
-                    break
+def write_in_core(file_path, lines, found, cores):
 
-        line = old_file.readline().rstrip()
+    new_file = open(file_path, 'w', 1)
+
+    for line, core in zip(lines, found):
+        if core >= 0:
+            new_file.write(line+'\t'+cores[1][core].rstrip()+'\n')
 
-    old_file.close()
     new_file.close()
 
 
+def in_core(file_path, cores, region=None, stats=metrics.NULL):
 
-# Main flow
-args = parse_args()
-cores = read_cores(args.core_file)
+    with stats.stage('read_windows'):
+        old_file = open(file_path, 'r')
+
+        lines = []
+        line = old_file.readline().rstrip()
+
+        while line != '':
+            stats.count('lines_parsed')
+            split_line = line.split('\t')
+            if in_region(region, split_line[0], int(split_line[1]), int(split_line[1])+300):
+                lines.append(line)
+            line = old_file.readline().rstrip()
+
+        old_file.close()
 
-for path in args.file_path:
-    in_core(path, cores)
+        windows = []
+        for line in lines:
+            split_line = line.split('\t')
+            windows.append((split_line[0], int(split_line[1])))
+    stats.count('windows_kept', len(windows))
+
+    with stats.stage('search_cores'):
+        found = search_cores(windows, cores)
+    stats.count('core_matches', sum(core >= 0 for core in found))
+
+    with stats.stage('write_in_core'):
+        write_in_core(file_path+'.core', lines, found, cores)
+
+
+
+def main(args, stats=metrics.NULL, load_cores=read_cores):
+
+    # LOAD_CORES takes the arguments of read_cores; cnv_server.py passes one that keeps the cores it read.
+    # Windows reaching out of the region keep the core regions they overlap there.
+    with stats.stage('read_cores'):
+        cores = load_cores(args.core_file, widen_region(args.region, 300))
+
+    for path in args.file_path:
+        in_core(path, cores, args.region, stats)
+
+
+# Main flow
+if __name__ == '__main__':
+    args = parse_args()
+    stats = metrics.from_args(args)
+    main(args, stats)
+    stats.write()
 
 
 
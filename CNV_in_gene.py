@@ -15,14 +15,20 @@
 ##########################################################
 
 
-import argparse, io, sys, os
+import argparse, io, os
 from collections import defaultdict
 
+import gff_cache, metrics
+from intervals import Interval_index, parse_region, in_region, widen_region
+
 def parse_args():
 
     parser = argparse.ArgumentParser(description='Find genes in the potential deletion windows.')
     parser.add_argument('window_file', help='The potential deletion windows file')
     parser.add_argument('genome_file', help='Gemone file from "http://plasmodb.org/common/downloads/Current_Release/Pfalciparum3D7/gff/data/"')
+    parser.add_argument('--region', type=parse_region, help='Only looks at the windows and genes overlapping REGION, written CHROM or CHROM:BEGIN-END, for example Pf3D7_05_v3:100000-120000')
+    parser.add_argument('--no_cache', action='store_true', help='Parse the genome file again instead of reading or writing its gene cache (GENOME_FILE.genes.npz)')
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -33,7 +39,7 @@ def parse_args():
     return args
 
 
-def read_data(file_path):
+def read_data(file_path, region=None):
 
     # deletions structre:
     # deletions key: chromosome -> 2nd dict key: window begin location -> 3rd key: window end location -> core info
@@ -43,7 +49,8 @@ def read_data(file_path):
 
     for line in file:
         split_line = line.split('\t')
-        deletions[split_line[0]][int(split_line[1])][int(split_line[1])+300]=split_line[2]
+        if in_region(region, split_line[0], int(split_line[1]), int(split_line[1])+300):
+            deletions[split_line[0]][int(split_line[1])][int(split_line[1])+300]=split_line[2]
 
     file.close()
 
@@ -52,96 +59,57 @@ def read_data(file_path):
      
 class Gene_bank:
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, cache=True, region=None):
 
 
         # gene_bank structure:
-        # gene_bank key: chrom -> 2nd dict key: gene_begin location//10000 -> 3rd dict key: (gene_begin location, gene_end location) -> gene ID
-        self.gene_bank = defaultdict(lambda: defaultdict(dict))
+        # gene_bank: Interval_index over all the genes -> gene number
+        # genes: gene number -> gene ID
+        self.genes = []
         
-        self.build_gene_bank(file_path)
+        self.build_gene_bank(file_path, cache, region)
         
 
-    def build_gene_bank(self, file_path):
+    def build_gene_bank(self, file_path, cache=True, region=None):
         
-        file = io.open(file_path)
+        chroms, begins, ends, self.genes = gff_cache.read_genes(file_path, cache)
+        if region is not None:
+            chroms, begins, ends, self.genes = gff_cache.select_genes(chroms, begins, ends, self.genes, region)
+        self.gene_bank = Interval_index(chroms, begins, ends)
         
-        for line in file:
-            
-            if line[0] == '#':
-                continue
-
-            if not line.startswith('Pf'):
-                sys.stderr.write('Error in "{0}": Unexpected data format.\n'.format(file_path))
-                sys.exit(1)
-            
-            split_line = line.split('\t')
-            if split_line[2] == 'gene':
-                loc_chrom = split_line[0]
-                loc_beg = split_line[3]
-                loc_end = split_line[4]
-                gene_id = split_line[-1].strip()
-
-                if not loc_beg or not loc_end:
-                    continue
-                
-                loc_beg = int(loc_beg)
-                loc_end = int(loc_end)
         
-                code_beg = loc_beg//10000
-                code_end = loc_end//10000     
-                
-                chrom = self.gene_bank[loc_chrom]
-                chrom[code_beg][(loc_beg, loc_end)] = gene_id
-
-                # If a gene spans the edges of two buckets, then it is added in both.
-                if code_beg != code_end:                    
-
-                    chrom[code_end][(loc_beg, loc_end)] = gene_id
-
-        file.close()
-        
-        
-    def search_genes(self, loc_chrom, loc_beg, loc_end, genes):
+    def search_genes(self, loc_chrom, loc_begs, loc_ends, genes):
 
+        # Takes all the windows of a chromosome at once.
         # genes structure:
-        # genes key: gene location tuple(begin location, end location) -> gene ID
+        # genes key: gene ID -> chromosome
 
-        chrom = self.gene_bank[loc_chrom]
-        code_beg = loc_beg//10000
-        code_end = loc_end//10000
-        
-        if code_beg in chrom:
-            for loc in chrom[code_beg]:
-                
-                if loc[0]>loc_end or loc[1]<loc_beg:
-                    continue
-                genes[chrom[code_beg][loc]] = chrom
-                
-        if code_beg != code_end:
-            if code_end in chrom:
-                for loc in chrom[code_end]:
-                    
-                    if loc[0]>loc_end or loc[1]<loc_beg:
-                        continue
-                    genes[chrom[code_end][loc]] = chrom
+        for gene in self.gene_bank.search(loc_chrom, loc_begs, loc_ends)[1].tolist():
+            genes[self.genes[gene]] = loc_chrom
                     
         
               
-def find_deleted_genes(gene_bank, deletes):
+def search_deleted_genes(gene_bank, deletes):
 
-    file = open('deleted_core_genes.txt', 'w')
+    # genes structure:
+    # genes key: gene ID -> chromosome
     genes = {}
+
+    for chrom in sorted(deletes.keys()):
+        windows = [(loc_beg, loc_end) for loc_beg in deletes[chrom] for loc_end in deletes[chrom][loc_beg]]
+                
+        gene_bank.search_genes(chrom, [window[0] for window in windows], [window[1] for window in windows], genes)
+
+    return genes
+
+
+def write_deleted_genes(genes, header=True, file_path='deleted_core_genes.txt'):
+
+    file = open(file_path, 'w')
     
-    if deletes:
+    if header:
         file.write('Deleted genes:\n')
 
-        for chrom in sorted(deletes.keys()):
-            for loc_beg in sorted(deletes[chrom].keys()):
-                for loc_end in sorted(deletes[chrom][loc_beg].keys()):            
-                    
-                    gene_bank.search_genes(chrom, loc_beg, loc_end, genes)
-
     if genes:
         for gene in sorted(genes.keys()):
             
@@ -153,8 +121,33 @@ def find_deleted_genes(gene_bank, deletes):
     file.close()
     
 
+def find_deleted_genes(gene_bank, deletes):
+
+    write_deleted_genes(search_deleted_genes(gene_bank, deletes), bool(deletes))
+
+
+def main(args, stats=metrics.NULL, load_gene_bank=Gene_bank):
+
+    # LOAD_GENE_BANK takes the arguments of Gene_bank; cnv_server.py passes one that keeps the banks it built.
+    with stats.stage('read_data'):
+        deletes = read_data(args.window_file, args.region)
+    # Windows reaching out of the region keep the genes they overlap there.
+    with stats.stage('gene_bank'):
+        gene_bank = load_gene_bank(args.genome_file, not args.no_cache, widen_region(args.region, 300))
+    stats.count('genes', len(gene_bank.genes))
+
+    with stats.stage('search_genes'):
+        genes = search_deleted_genes(gene_bank, deletes)
+    stats.count('gene_queries', sum(len(deletes[chrom][loc_beg]) for chrom in deletes for loc_beg in deletes[chrom]))
+    stats.count('gene_hits', len(genes))
+
+    with stats.stage('write_deleted_genes'):
+        write_deleted_genes(genes, bool(deletes))
+
+
 # Main flow
-args = parse_args()
-deletes = read_data(args.window_file)
-gene_bank = Gene_bank(args.genome_file)
-find_deleted_genes(gene_bank, deletes)
+if __name__ == '__main__':
+    args = parse_args()
+    stats = metrics.from_args(args)
+    main(args, stats)
+    stats.write()
@@ -0,0 +1,214 @@
+##########################################################
+#
+# CNV_pipeline.py
+#
+# Run all the steps of Method1 or Method2 in one
+# process, from the data files to the deleted core
+# genes. The tables are passed from step to step in
+# memory; intermediate files are only written with
+# --keep.
+#
+# Written using Python 3.6.5
+#
+##########################################################
+
+import argparse, os
+from collections import defaultdict
+
+import bin_reader, metrics
+
+import find_deletion_windows, find_deleted_genes, find_deleted_core_genes
+import CNV_Match, CNV_in_core, CNV_in_gene
+from intervals import parse_region, in_region, widen_region
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Run a whole method, from the data files to deleted_core_genes.txt, in one process.')
+    subparsers = parser.add_subparsers(dest='method')
+    subparsers.required = True
+
+    method1 = subparsers.add_parser('method1', help='find_deletion_windows.py -> find_deleted_genes.py -> find_deleted_core_genes.py')
+    method1.add_argument('genome_file', help='Gemone file from "http://plasmodb.org/common/downloads/Current_Release/Pfalciparum3D7/gff/data/"')
+    method1.add_argument('core_genome_file', help='Core_gemone file')
+    method1.add_argument('data_file', help='an input data file', nargs = '+')
+    method1.add_argument('--cut_off', '-c', type=float, default=0.01, help='Only condsiders values below CUT_OFF as potential deletions. Default = 0.01')
+    method1.add_argument('--low_bound', '-l', type=int, default=3, help='Only returns results of at least LOW_BOUND consecutive windows. Default = 3')
+    method1.add_argument('--interval', '-i', type=int, nargs = 2, default=[10, 40], help='Only considers windows with numbers of deletions within the interval. Default = [10, 40]. Example input: 10 40')
+    method1.add_argument('--jobs', '-j', type=int, default=1, help='Number of processes that read the data files, then find the cut-offs and runs of blocks of progenies, sharing one copy of the data. Default = 1')
+    method1.add_argument('--storage', choices=list(find_deletion_windows.STORAGE), default='float32', help='How the values are kept in memory: float64, float32 or fixed16 (2 bytes, values with at most 5 decimals). Default = float32')
+    method1.add_argument('--out_of_core', help='Keep the data in a file in the directory OUT_OF_CORE instead of memory, and search it CHUNK_WINDOWS windows at a time. Not taken with --jobs')
+    method1.add_argument('--chunk_windows', type=int, default=4096, help='With --out_of_core, number of windows read from the file at once. Default = 4096')
+    method1.add_argument('--columnar', action='store_true', help='Write the output (and the files kept with --keep) as npz tables with one typed column per field instead of text')
+
+    method2 = subparsers.add_parser('method2', help='CNV_Match.py -> CNV_in_core.py -> CNV_in_gene.py')
+    method2.add_argument('core_file', help='Core_gemone file')
+    method2.add_argument('genome_file', help='Gemone file from "http://plasmodb.org/common/downloads/Current_Release/Pfalciparum3D7/gff/data/"')
+    method2.add_argument('data_file', help='an input data file', nargs='+')
+    method2.add_argument('--low_bound', '-l', type=int, default = 5, help='only return windows that have at least LOW_BOUND zeros')
+    method2.add_argument('--stream', '-s', action='store_true', help='read the files line by line and merge them in sorted order, keeping memory flat. Every file must be sorted by chromosome and window')
+    method2.add_argument('--jobs', '-j', type=int, default = 1, help='number of processes that read the files')
+    method2.add_argument('--packed', '-p', action='store_true', help='keep the zero calls as a bit matrix, one bit per progeny and window, and count them from it')
+
+    for method in [method1, method2]:
+        method.add_argument('--keep', '-k', action='store_true', help='also write the intermediate files of every step')
+        method.add_argument('--region', type=parse_region, help='only look at the windows, core regions and genes overlapping REGION, written CHROM or CHROM:BEGIN-END, for example Pf3D7_05_v3:100000-120000')
+        method.add_argument('--prefetch', type=int, default=bin_reader.PREFETCH_FILES, help='without --jobs, number of data files read at once in background threads while they are parsed in order. 0 reads them in turn. Default = {0}'.format(bin_reader.PREFETCH_FILES))
+        method.add_argument('--no_cache', action='store_true', help='Parse the genome file again instead of reading or writing its gene cache (GENOME_FILE.genes.npz)')
+        metrics.add_arguments(method)
+
+    args = parser.parse_args()
+
+    paths = list(args.data_file)+[args.genome_file, args.core_genome_file if args.method == 'method1' else args.core_file]
+    for path in paths:
+        if not os.path.isfile(path):
+            parser.error('File "{0}" cannot be found.'.format(path))
+
+    if args.method == 'method1' and args.out_of_core is not None:
+        if args.jobs > 1:
+            parser.error('--out_of_core and --jobs cannot be used together.')
+        if not os.path.isdir(args.out_of_core):
+            parser.error('Directory "{0}" cannot be found.'.format(args.out_of_core))
+    if args.method == 'method1' and args.chunk_windows < 1:
+        parser.error('--chunk_windows must be at least 1.')
+    if args.method == 'method2' and args.stream and args.jobs > 1:
+        parser.error('--stream and --jobs cannot be used together.')
+    if args.method == 'method2' and args.stream and args.packed:
+        parser.error('--stream and --packed cannot be used together.')
+
+    return args
+
+
+def deletion_table(deletes, region=None):
+
+    # The windows as find_deleted_genes.read_data reads them from deletion_windows.txt.
+    windows = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    for end in deletes:
+        if in_region(region, end[0], deletes[end][0][1], end[1]+300):
+            windows[end[0]][deletes[end][0][1]][end[1]+300] = deletes[end][1]
+
+    return windows
+
+
+def gene_table(hits, region=None):
+
+    # The genes as find_deleted_core_genes.read_data reads them from deleted_genes.txt.
+    genes = defaultdict(lambda: defaultdict(tuple))
+    for chrom, found in hits:
+        for loc in found:
+            if in_region(region, chrom, loc[0], loc[1]):
+                genes[chrom][loc] = found[loc]
+
+    return genes
+
+
+def core_window_table(windows, found, cores):
+
+    # The windows as CNV_in_gene.read_data reads them from data.map.core.
+    deletes = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    for window, core in zip(windows, found):
+        if core >= 0:
+            deletes[window[0]][window[1]][window[1]+300] = cores[1][core]
+
+    return deletes
+
+
+def run_method1(args, stats=metrics.NULL):
+
+    with stats.stage('read_data'):
+        if args.out_of_core is None:
+            engine, chroms, positions, chrom_names = find_deletion_windows.read_engine(args.data_file, args.jobs, None, bin_reader.bin_region(args.region), stats, args.storage, args.prefetch)
+        else:
+            data_path, shape, chroms, positions, chrom_names = find_deletion_windows.write_data(args.data_file, args.out_of_core, bin_reader.bin_region(args.region), stats, args.storage, args.prefetch)
+            engine = find_deletion_windows.Chunk_engine(data_path, shape, find_deletion_windows.STORAGE[args.storage], args.chunk_windows)
+    stats.count('windows_kept', engine.data.shape[0])
+    stats.count('progenies', engine.data.shape[1])
+
+    with engine:
+        with stats.stage('find_cut_off'):
+            cut_off_values = engine.cut_off(args.cut_off)
+        with stats.stage('count_runs'):
+            run_num, keys, first, counts = engine.counts(cut_off_values, args.low_bound)
+    stats.count('runs_found', run_num)
+    del engine
+
+    with stats.stage('combine_deletes'):
+        deletes = find_deletion_windows.combine_deletes(keys, first, counts, chroms.size, chroms, positions, chrom_names, args.interval)
+    stats.count('intervals_counted', keys.size)
+    stats.count('deletion_windows', len(deletes))
+    if args.keep:
+        with stats.stage('write_in_file'):
+            if args.columnar:
+                find_deletion_windows.write_in_table(deletes)
+            else:
+                find_deletion_windows.write_in_file(deletes)
+
+    # As in the scripts of each step, windows and genes reaching out of the region keep the genes and core regions
+    # they overlap there.
+    windows = deletion_table(deletes, args.region)
+    longest = max([loc_end-loc_beg for chrom in windows for loc_beg in windows[chrom] for loc_end in windows[chrom][loc_beg]]+[0])
+    with stats.stage('gene_bank'):
+        gene_bank = find_deleted_genes.Gene_bank(args.genome_file, not args.no_cache, widen_region(args.region, longest))
+    with stats.stage('search_genes'):
+        hits = find_deleted_genes.search_deleted_genes(gene_bank, windows)
+    stats.count('gene_queries', len(hits))
+    stats.count('gene_hits', sum(len(found) for chrom, found in hits))
+    if args.keep:
+        with stats.stage('write_deleted_genes'):
+            if args.columnar:
+                find_deleted_genes.write_deleted_genes_table(hits)
+            else:
+                find_deleted_genes.write_deleted_genes(hits)
+
+    genes = gene_table(hits, args.region)
+    with stats.stage('search_core_genes'):
+        longest = max([loc[1]-loc[0] for chrom in genes for loc in genes[chrom]]+[0])
+        core_genome = find_deleted_core_genes.read_data(args.core_genome_file, widen_region(args.region, longest))
+        core_genes = find_deleted_core_genes.search_core_genes(core_genome, genes)
+    stats.count('core_matches', len(core_genes))
+
+    with stats.stage('write_core_genes'):
+        if args.columnar:
+            find_deleted_core_genes.write_core_genes_table(core_genes)
+        else:
+            find_deleted_core_genes.write_core_genes(core_genes, bool(genes))
+
+
+def run_method2(args, stats=metrics.NULL):
+
+    with stats.stage('find_windows'):
+        windows = list(CNV_Match.deletion_windows(args.data_file, args.low_bound, args.stream, args.jobs, bin_reader.bin_region(args.region), stats, args.packed, args.prefetch))
+    stats.count('windows_kept', len(windows))
+    if args.keep:
+        with stats.stage('write_deletions'):
+            CNV_Match.write_deletions(windows)
+
+    with stats.stage('search_cores'):
+        cores = CNV_in_core.read_cores(args.core_file, widen_region(args.region, 300))
+        found = CNV_in_core.search_cores(windows, cores)
+    stats.count('core_matches', sum(core >= 0 for core in found))
+    if args.keep:
+        with stats.stage('write_in_core'):
+            CNV_in_core.write_in_core('data.map.core', [chrom+'\t'+str(pos) for chrom, pos in windows], found, cores)
+
+    deletes = core_window_table(windows, found, cores)
+    with stats.stage('gene_bank'):
+        gene_bank = CNV_in_gene.Gene_bank(args.genome_file, not args.no_cache, widen_region(args.region, 300))
+    with stats.stage('search_genes'):
+        genes = CNV_in_gene.search_deleted_genes(gene_bank, deletes)
+    stats.count('gene_queries', sum(len(deletes[chrom][loc_beg]) for chrom in deletes for loc_beg in deletes[chrom]))
+    stats.count('gene_hits', len(genes))
+
+    with stats.stage('write_deleted_genes'):
+        CNV_in_gene.write_deleted_genes(genes, bool(deletes))
+
+
+# Main flow
+if __name__ == '__main__':
+    args = parse_args()
+    stats = metrics.from_args(args)
+
+    if args.method == 'method1':
+        run_method1(args, stats)
+    else:
+        run_method2(args, stats)
+    stats.write()
@@ -0,0 +1,166 @@
+##############################################################
+#
+# benchmark.py
+#
+# Time the steps of Method1 and Method2 on synthetic cohorts
+# (see make_synthetic_cohort.py) of growing size, and write
+# the wall time, CPU time and memory of every step to a JSON
+# file, so changes to the scripts can be compared.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import argparse, json, os, platform, resource, shutil, statistics, sys, tempfile, time, tracemalloc
+
+import numpy as np
+
+import make_synthetic_cohort, gff_cache, metrics
+import find_deletion_windows, find_deleted_genes, find_deleted_core_genes
+import CNV_Match, CNV_in_core, CNV_in_gene
+from CNV_pipeline import deletion_table, gene_table, core_window_table
+
+def parse_size(text):
+
+    # 'BINSxPROGENIES' -> (bins, progenies)
+    try:
+        bin_num, pro_num = [int(part) for part in text.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Size "{0}" must be written BINSxPROGENIES, for example 2000x51.'.format(text))
+    if bin_num < 1 or pro_num < 1:
+        raise argparse.ArgumentTypeError('Size "{0}" must have at least 1 bin and 1 progeny.'.format(text))
+
+    return (bin_num, pro_num)
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Time the steps of Method1 and Method2 on synthetic cohorts.')
+    parser.add_argument('--sizes', '-s', type=parse_size, nargs='+', default=[(500, 51), (2000, 51), (2000, 500)], help='Cohort sizes, each written BINSxPROGENIES with BINS the windows of each chromosome. Default = 500x51 2000x51 2000x500')
+    parser.add_argument('--chromosomes', '-n', type=int, default=14, help='Number of chromosomes of every cohort. Default = 14')
+    parser.add_argument('--deletions', '-d', type=int, default=20, help='Number of planted deletions of every cohort. Default = 20')
+    parser.add_argument('--compress', choices=['none', 'gzip', 'bgzf'], default='none', help='Compression of the bin files. Default = none')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of processes the steps that take -j use. Default = 1')
+    parser.add_argument('--repeat', '-r', type=int, default=3, help='Number of timed runs of every step. Default = 3')
+    parser.add_argument('--no_memory', action='store_true', help='Skip the extra run of every step that measures its memory')
+    parser.add_argument('--work_dir', '-w', help='Directory the cohorts are written to and kept. Default = a temporary directory, removed at the end')
+    parser.add_argument('--output', '-o', default='benchmark.json', help='Output file. Default = benchmark.json')
+
+    args = parser.parse_args()
+
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1.')
+
+    return args
+
+
+def measure(stages, name, memory, repeat, function, *arguments):
+
+    # Runs FUNCTION REPEAT times, then once more under tracemalloc for the peak memory, and returns its last result.
+    # Memory used by other processes (with -j) is only seen in the max_rss of the children. Both are in bytes, as in the metrics files.
+    walls = []
+    cpus = []
+    for n in range(repeat):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        result = function(*arguments)
+        cpus.append(time.process_time()-cpu)
+        walls.append(time.perf_counter()-wall)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        result = function(*arguments)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    stage = {'stage': name, 'wall': walls, 'cpu': cpus, 'wall_median': statistics.median(walls), 'cpu_median': statistics.median(cpus),
+             'peak_memory': peak, 'max_rss': metrics.max_rss(),
+             'max_rss_children': metrics.max_rss(resource.RUSAGE_CHILDREN)}
+    stages.append(stage)
+    sys.stdout.write('  {0:24} {1:10.4f} s {2}\n'.format(name, stage['wall_median'], '' if peak is None else '{0:10.1f} MB'.format(peak/2**20)))
+
+    return result
+
+
+def cohort_args(bin_num, pro_num, args):
+
+    # The options of make_synthetic_cohort.py, at their defaults except the size.
+    return argparse.Namespace(chromosomes=args.chromosomes, bins=bin_num, progenies=pro_num, files=1, api_bins=20, deletions=args.deletions,
+                              deletion_length=[3, 30], deletion_progenies=[10, 40], zero_rate=0.001, deletion_zero_rate=0.3,
+                              compress=args.compress, seed=0)
+
+
+def run_method1(stages, paths, gff_path, core_path, args):
+
+    memory = not args.no_memory
+    data, chroms, positions, chrom_names = measure(stages, 'method1.read_data', memory, args.repeat, find_deletion_windows.read_data, paths, args.jobs)
+    cut_off_values = measure(stages, 'method1.find_cut_off', memory, args.repeat, find_deletion_windows.find_cut_off, data, 0.01)
+    deletes = measure(stages, 'method1.find_deletes', memory, args.repeat, find_deletion_windows.find_deletes, data, chroms, positions, chrom_names,
+                      cut_off_values, 3, [10, 40], args.jobs)
+
+    gene_bank = measure(stages, 'method1.gene_bank', memory, args.repeat, find_deleted_genes.Gene_bank, gff_path)
+    hits = measure(stages, 'method1.gene_search', memory, args.repeat, find_deleted_genes.search_deleted_genes, gene_bank, deletion_table(deletes))
+
+    genes = gene_table(hits)
+    core_genome = find_deleted_core_genes.read_data(core_path)
+    core_genes = measure(stages, 'method1.core_join', memory, args.repeat, find_deleted_core_genes.search_core_genes, core_genome, genes)
+
+    return {'deletion_windows': len(deletes), 'deleted_genes': sum(len(found) for chrom, found in hits), 'deleted_core_genes': len(core_genes)}
+
+
+def run_method2(stages, paths, gff_path, core_path, args):
+
+    memory = not args.no_memory
+    windows = measure(stages, 'method2.find_windows', memory, args.repeat, lambda: list(CNV_Match.deletion_windows(paths, 5, jobs=args.jobs)))
+
+    cores = CNV_in_core.read_cores(core_path)
+    found = measure(stages, 'method2.in_core', memory, args.repeat, CNV_in_core.search_cores, windows, cores)
+
+    gene_bank = measure(stages, 'method2.gene_bank', memory, args.repeat, CNV_in_gene.Gene_bank, gff_path)
+    genes = measure(stages, 'method2.gene_search', memory, args.repeat, CNV_in_gene.search_deleted_genes, gene_bank, core_window_table(windows, found, cores))
+
+    return {'deletion_windows': len(windows), 'core_windows': sum(core >= 0 for core in found), 'deleted_core_genes': len(genes)}
+
+
+def benchmark(args):
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='cnv_benchmark_')
+
+    # report structure:
+    # the machine and options, then one run per size with the time and memory of every step
+    report = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count(),
+              'chromosomes': args.chromosomes, 'deletions': args.deletions, 'compress': args.compress, 'jobs': args.jobs,
+              'repeat': args.repeat, 'runs': []}
+
+    try:
+        for bin_num, pro_num in args.sizes:
+            sys.stdout.write('{0} windows x {1} progenies:\n'.format(bin_num*args.chromosomes, pro_num))
+            output_dir = os.path.join(work_dir, '{0}x{1}'.format(bin_num, pro_num))
+            paths = make_synthetic_cohort.make_cohort(output_dir, cohort_args(bin_num, pro_num, args))
+            gff_path = os.path.join(output_dir, 'genome.gff')
+            core_path = os.path.join(output_dir, 'core.txt')
+
+            # The gene cache is made here, so every run of the gene steps reads it as later runs of the scripts do.
+            gff_cache.read_genes(gff_path)
+
+            stages = []
+            found = {'method1': run_method1(stages, paths, gff_path, core_path, args),
+                     'method2': run_method2(stages, paths, gff_path, core_path, args)}
+            report['runs'].append({'bins': bin_num, 'progenies': pro_num, 'windows': bin_num*args.chromosomes,
+                                   'data_bytes': sum(os.path.getsize(path) for path in paths), 'found': found, 'stages': stages})
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return report
+
+
+# Main flow
+if __name__ == '__main__':
+    args = parse_args()
+    report = benchmark(args)
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+        file.write('\n')
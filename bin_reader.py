@@ -0,0 +1,559 @@
+##############################################################
+#
+# bin_reader.py
+#
+# Read bin files (see data_format_example.txt) that are plain
+# text, gzip or BGZF compressed. An index of the windows of
+# each chromosome, kept next to the file, lets a run limited
+# to one chromosome read (and decompress) only the part of
+# the file it needs. Files can be read ahead in background
+# threads while the current one is parsed.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import contextlib, gzip, io, os, queue, struct, sys, threading, zlib
+
+import numpy as np
+
+# A new index entry is made at least every INDEX_STEP lines.
+INDEX_STEP = 256
+
+# read_chunks reads about CHUNK_SIZE bytes at a time.
+CHUNK_SIZE = 1 << 22
+
+# Each file read in the background keeps at most PREFETCH_DEPTH blocks of lines ready,
+# and read_files reads up to PREFETCH_FILES files at once, the one being parsed and the next ones.
+PREFETCH_DEPTH = 4
+PREFETCH_FILES = 3
+
+
+def file_kind(path):
+
+    # Returns 'bgzf', 'gzip' or 'text'.
+    with open(path, 'rb') as file:
+        header = file.read(18)
+
+    if header[:2] != b'\x1f\x8b':
+        return 'text'
+    if len(header) == 18 and header[3] & 4 and header[12:14] == b'BC':
+        return 'bgzf'
+    return 'gzip'
+
+
+def open_bin_file(path):
+
+    # Returns a text stream over the whole file.
+    if file_kind(path) == 'text':
+        return io.open(path)
+    return gzip.open(path, 'rt')
+
+
+def read_block(file, coffset):
+
+    # Returns (data, size) of the BGZF block starting at COFFSET, or (None, 0) at the end of the file.
+    file.seek(coffset)
+    header = file.read(12)
+    if len(header) < 12:
+        return (None, 0)
+
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = file.read(xlen)
+    bsize = None
+    n = 0
+    while n+4 <= xlen:
+        slen = struct.unpack('<H', extra[n+2:n+4])[0]
+        if extra[n:n+2] == b'BC':
+            bsize = struct.unpack('<H', extra[n+4:n+6])[0]+1
+        n += 4+slen
+    if bsize is None:
+        raise ValueError('Not a BGZF block at offset {0}.'.format(coffset))
+
+    data = zlib.decompress(file.read(bsize-12-xlen-8), -15)
+    return (data, bsize)
+
+
+def iter_bgzf_lines(path, voffset=0):
+
+    # Yields (virtual offset, line) from the line starting at the virtual offset VOFFSET on.
+    # A virtual offset is the offset of the block in the file << 16 | the offset of the line in the block.
+    with open(path, 'rb') as file:
+        coffset = voffset >> 16
+        start = voffset & 0xffff
+        pending = b''
+        pending_offset = None
+
+        while True:
+            data, size = read_block(file, coffset)
+            if data is None:
+                break
+
+            while True:
+                end = data.find(b'\n', start)
+                if end < 0:
+                    if start < len(data):
+                        if not pending:
+                            pending_offset = coffset << 16 | start
+                        pending += data[start:]
+                    break
+                if pending:
+                    yield (pending_offset, pending+data[start:end+1])
+                    pending = b''
+                else:
+                    yield (coffset << 16 | start, data[start:end+1])
+                start = end+1
+
+            coffset += size
+            start = 0
+
+        if pending:
+            yield (pending_offset, pending)
+
+
+def iter_text_lines(path, offset=0):
+
+    # Yields (offset, line) from the line starting at OFFSET on.
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        for line in file:
+            yield (offset, line)
+            offset += len(line)
+
+
+def split_bin(name):
+
+    # 'Pf3D7_01_v3_12' -> ('Pf3D7_01_v3', 12), or None if NAME is not a bin.
+    chrom, sep, num = name.rpartition('_')
+    if not sep or not num.isdigit():
+        return None
+    return (chrom, int(num))
+
+
+def index_path(path):
+
+    return path+'.idx.npz'
+
+
+def build_index(path):
+
+    # index structure:
+    # chrom_names: chromosomes in the order of the file
+    # codes, bins, offsets: one entry where each chromosome begins and then every INDEX_STEP lines,
+    # with the chromosome code, the bin and the (virtual) offset of the line
+    # ordered: whether the lines of each chromosome are together and sorted by bin
+    kind = file_kind(path)
+    if kind == 'gzip':
+        return None
+    lines = iter_bgzf_lines(path) if kind == 'bgzf' else iter_text_lines(path)
+
+    chrom_names = []
+    chrom_codes = {}
+    ordered = []
+    codes = []
+    bins = []
+    offsets = []
+    last = None
+    step = 0
+
+    next(lines, None)
+    for offset, line in lines:
+        split_line = line.split(None, 1)
+        loc = split_bin(split_line[0].decode()) if split_line else None
+        if loc is None:
+            continue
+        chrom, num = loc
+
+        if chrom not in chrom_codes:
+            chrom_codes[chrom] = len(chrom_names)
+            chrom_names.append(chrom)
+            ordered.append(True)
+        elif last[0] != chrom or num <= last[1]:
+            ordered[chrom_codes[chrom]] = False
+
+        if last is None or last[0] != chrom or step >= INDEX_STEP:
+            codes.append(chrom_codes[chrom])
+            bins.append(num)
+            offsets.append(offset)
+            step = 0
+        step += 1
+        last = loc
+
+    return {'chrom_names': chrom_names, 'codes': np.array(codes, dtype=np.int32), 'bins': np.array(bins, dtype=np.int64),
+            'offsets': np.array(offsets, dtype=np.uint64), 'ordered': np.array(ordered, dtype=bool)}
+
+
+def load_index(path):
+
+    # Reads the index of PATH, building and saving it first if it is missing or older than the file.
+    # Returns None for plain gzip files, which cannot be read from the middle.
+    stat = os.stat(path)
+    stamp = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    if os.path.isfile(index_path(path)):
+        try:
+            with np.load(index_path(path), allow_pickle=False) as saved:
+                if np.array_equal(saved['stamp'], stamp):
+                    index = {key: saved[key] for key in ['codes', 'bins', 'offsets', 'ordered']}
+                    index['chrom_names'] = saved['chrom_names'].tolist()
+                    return index
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = build_index(path)
+    if index is None:
+        return None
+
+    try:
+        with open(index_path(path)+'.tmp', 'wb') as file:
+            np.savez(file, stamp=stamp, chrom_names=np.array(index['chrom_names'], dtype=str), codes=index['codes'],
+                     bins=index['bins'], offsets=index['offsets'], ordered=index['ordered'])
+        os.replace(index_path(path)+'.tmp', index_path(path))
+    except OSError:
+        pass
+
+    return index
+
+
+def in_region(line, region):
+
+    # Lines that are not bins are kept, so the readers can report them.
+    split_line = line.split(None, 1)
+    loc = split_bin(split_line[0]) if split_line else None
+    if loc is None:
+        return True
+    chrom, first, last = region
+    return loc[0] == chrom and (first is None or loc[1] >= first) and (last is None or loc[1] <= last)
+
+
+def read_lines(path, region=None):
+
+    # Yields the lines of PATH after the header, only the ones of REGION if given.
+    # region structure: (chromosome, first bin, last bin); a bin of None leaves that side open.
+    if region is None:
+        file = open_bin_file(path)
+        file.readline()
+        for line in file:
+            yield line
+        file.close()
+        return
+
+    chrom, first, last = region
+    index = load_index(path)
+
+    # Without an index, or if the chromosome is scattered over the file, the whole file is read.
+    if index is None or (chrom in index['chrom_names'] and not index['ordered'][index['chrom_names'].index(chrom)]):
+        for line in read_lines(path):
+            if in_region(line, region):
+                yield line
+        return
+
+    if chrom not in index['chrom_names']:
+        return
+    entries = np.flatnonzero(index['codes'] == index['chrom_names'].index(chrom))
+
+    # Start from the last entry at or before the first bin.
+    bins = index['bins'][entries]
+    if first is not None and (bins <= first).any():
+        offset = int(index['offsets'][entries[bins <= first][-1]])
+    else:
+        offset = int(index['offsets'][entries[0]])
+
+    lines = iter_bgzf_lines(path, offset) if file_kind(path) == 'bgzf' else iter_text_lines(path, offset)
+    for offset, line in lines:
+        line = line.decode()
+        split_line = line.split(None, 1)
+        loc = split_bin(split_line[0]) if split_line else None
+        if loc is None:
+            yield line
+            continue
+        if loc[0] != chrom:
+            break
+        if last is not None and loc[1] > last:
+            break
+        if first is None or loc[1] >= first:
+            yield line
+
+
+def read_chunks(path, region=None, chunk_size=CHUNK_SIZE):
+
+    # Yields the lines of PATH after the header in blocks of whole lines of about CHUNK_SIZE bytes,
+    # only the lines of REGION if given.
+    if region is not None:
+        block = []
+        size = 0
+        for line in read_lines(path, region):
+            block.append(line)
+            size += len(line)
+            if size >= chunk_size:
+                yield ''.join(block).encode()
+                block = []
+                size = 0
+        if block:
+            yield ''.join(block).encode()
+        return
+
+    file = open(path, 'rb') if file_kind(path) == 'text' else gzip.open(path, 'rb')
+    file.readline()
+    rest = b''
+
+    while True:
+        data = file.read(chunk_size)
+        if not data:
+            break
+        data = rest+data
+        cut = data.rfind(b'\n')+1
+        rest = data[cut:]
+        if cut:
+            yield data[:cut]
+
+    if rest:
+        yield rest
+    file.close()
+
+
+class Prefetch:
+
+    # Runs ITEMS (an iterator) in a background thread, keeping at most DEPTH of them ready, and yields them
+    # in order. Reading and decompressing release the GIL, so they go on while the caller parses.
+    # An error in the thread (sys.exit included) is raised where the items are read.
+    def __init__(self, items, depth=PREFETCH_DEPTH):
+
+        self.queue = queue.Queue(depth)
+        self.thread = threading.Thread(target=self.run, args=(items,), daemon=True)
+        self.thread.start()
+
+
+    def run(self, items):
+
+        try:
+            for item in items:
+                self.queue.put((True, item))
+        except BaseException as error:
+            self.queue.put((False, error))
+            return
+        self.queue.put((False, None))
+
+
+    def __iter__(self):
+
+        while True:
+            ok, item = self.queue.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            yield item
+
+
+@contextlib.contextmanager
+def exit_on_error():
+
+    # Errors in the data files are raised as ValueError with their message, as sys.exit in a worker process
+    # would leave the pool waiting for it forever. The run stops here, in the process that reads the files.
+    try:
+        yield
+    except ValueError as error:
+        sys.stderr.write('{0}\n'.format(error))
+        sys.exit(1)
+
+
+def read_files(paths, region=None, prefetch=PREFETCH_FILES, chunk_size=CHUNK_SIZE):
+
+    # Yields (path, chunks) for every path in order, CHUNKS giving the blocks of lines of read_chunks.
+    # While a file is parsed, it and the next files, PREFETCH in all, are read in background threads.
+    # PREFETCH 0 reads every file in turn, as it is parsed.
+    if prefetch < 1:
+        for path in paths:
+            yield (path, read_chunks(path, region, chunk_size))
+        return
+
+    started = {}
+    for n, path in enumerate(paths):
+        for m in range(n, min(n+prefetch, len(paths))):
+            if m not in started:
+                started[m] = Prefetch(read_chunks(paths[m], region, chunk_size))
+        yield (path, started.pop(n))
+
+
+def find_words(chunk):
+
+    # Returns (chars, starts, ends, firsts): the bytes of CHUNK, where every word (a run of bytes above
+    # the space) begins and ends, and the numbers of the words that begin a line.
+    chars = np.frombuffer(chunk, dtype=np.uint8)
+    space = np.ones(chars.size+2, dtype=bool)
+    np.less_equal(chars, 32, out=space[1:-1])
+
+    edges = np.flatnonzero(space[1:] != space[:-1])
+    starts = edges[0::2]
+    ends = edges[1::2]
+
+    # A line begins with the first word after a newline; blank lines have no word.
+    firsts = np.searchsorted(starts, np.flatnonzero(chars == 10))
+    firsts = np.unique(np.concatenate(([0], firsts[firsts < starts.size]))) if starts.size else firsts[:0]
+
+    return (chars, starts, ends, firsts)
+
+
+def parse_chunk(chunk, dtype=np.float32, usecols=None):
+
+    # Splits a block of lines into the first word of each line (the bin names) and a DTYPE array of the
+    # other words, all parsed at once by numpy's reader. The values are the same as float() of each word gives.
+    # USECOLS, if given, are the only words parsed (the names being word 0), in that order; the other words are
+    # skipped without being read as numbers, but every line must still have as many words as the first.
+    # Returns (names, None) when the lines do not all have the same number of words or a word is not a
+    # number, so the caller can split each line.
+    lines = [line for line in chunk.splitlines() if not line.isspace() and line]
+    names = [line.split(None, 1)[0].decode() for line in lines]
+    if not names:
+        return (names, np.empty((0, 0 if usecols is None else len(usecols)), dtype=dtype))
+
+    pro_num = len(lines[0].split())-1
+    if usecols is None:
+        usecols = range(1, pro_num+1)
+    if pro_num == 0:
+        if any(len(line.split()) != 1 for line in lines) or len(usecols):
+            return (names, None)
+        return (names, np.empty((len(names), 0), dtype=dtype))
+    if any(not 1 <= column <= pro_num for column in usecols):
+        return (names, None)
+
+    if len(usecols):
+        try:
+            values = np.loadtxt(io.BytesIO(chunk), dtype=dtype, usecols=usecols, comments=None, ndmin=2)
+        except ValueError:
+            return (names, None)
+    else:
+        values = np.empty((len(names), 0), dtype=dtype)
+
+    # usecols leaves out any words after the first line's, so longer lines are caught here (lines split by
+    # anything but single tabs are left to the caller).
+    if values.shape[0] != len(names) or any(line.rstrip().count(b'\t') != pro_num for line in lines):
+        return (names, None)
+
+    return (names, values)
+
+
+def count_zero_words(chunk):
+
+    # Returns (names, counts): the first word of each line of CHUNK and how many of its other words are '0'.
+    chars, starts, ends, firsts = find_words(chunk)
+    names = [chunk[begin:end].decode() for begin, end in zip(starts[firsts].tolist(), ends[firsts].tolist())]
+
+    lines = np.zeros(starts.size, dtype=np.int64)
+    lines[firsts[1:]] = 1
+    zeros = (ends-starts == 1) & (chars[starts] == 48)
+    zeros[firsts] = False
+    counts = np.bincount(np.cumsum(lines)[zeros], minlength=len(names))
+
+    return (names, counts)
+
+
+def zero_bits(chunk):
+
+    # Returns (names, bits, width): the first word of each line of CHUNK and a bit per other word, set where
+    # the word is '0', packed eight words to a byte with np.packbits, WIDTH being the most words after the
+    # first of a line. Short lines are padded with unset bits.
+    chars, starts, ends, firsts = find_words(chunk)
+    names = [chunk[begin:end].decode() for begin, end in zip(starts[firsts].tolist(), ends[firsts].tolist())]
+
+    lines = np.zeros(starts.size, dtype=np.int64)
+    lines[firsts[1:]] = 1
+    lines = np.cumsum(lines)
+    words = np.arange(starts.size)-firsts[lines] if starts.size else lines
+    zeros = (ends-starts == 1) & (chars[starts] == 48) & (words > 0)
+
+    width = int(words.max()) if words.size else 0
+    mask = np.zeros((len(names), width), dtype=bool)
+    mask[lines[zeros], words[zeros]-1] = True
+
+    return (names, np.packbits(mask, axis=1), width)
+
+
+def decode_bins(names):
+
+    # Splits bin names such as 'Pf3D7_01_v3_12' at the last '_' into chromosome and bin number, all at once.
+    # Returns (chrom_names, codes, bins): codes index chrom_names, which are in the order they first appear.
+    # Returns None if a name does not end with '_' and a bin number.
+    if not names:
+        return ([], np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    table = np.array([name.encode() for name in names])
+    width = table.itemsize
+    chars = table.view(np.uint8).reshape(len(names), width)
+    cols = np.arange(width)
+
+    under = chars == 95
+    cut = width-1-np.argmax(under[:, ::-1], axis=1)
+    after = (cols > cut[:, None]) & (chars != 0)
+    digits = chars.astype(np.int64)-48
+    if not under.any(1).all() or not after.any(1).all() or (after & ((digits < 0) | (digits > 9))).any() or after.sum(1).max() > 18:
+        return None
+
+    bins = np.zeros(len(names), dtype=np.int64)
+    for col in range(width):
+        bins = np.where(after[:, col], bins*10+digits[:, col], bins)
+
+    prefixes = np.where(cols < cut[:, None], chars, 0).astype(np.uint8).view('S{0}'.format(width)).ravel()
+    found, first, codes = np.unique(prefixes, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(order.size, dtype=np.int64)
+    rank[order] = np.arange(order.size)
+
+    return ([found[n].decode() for n in order], rank[codes.ravel()], bins)
+
+
+def bin_region(region):
+
+    # Turns a region (chromosome, begin location, end location) into the (chromosome, first bin, last bin)
+    # of the windows overlapping it. A window N covers N*300 to N*300+300.
+    if region is None:
+        return None
+
+    chrom, begin, end = region
+    first = None if begin is None else max(0, -(-begin//300)-1)
+    last = None if end is None else end//300
+
+    return (chrom, first, last)
+
+
+class Bgzf_writer:
+
+    # Writes a BGZF file: gzip blocks of at most BLOCK_SIZE bytes of data, each with its size in a 'BC' extra field,
+    # ended by an empty block. Any gzip reader can read it, and read_lines can seek in it.
+    BLOCK_SIZE = 65280
+
+    def __init__(self, path):
+
+        self.file = open(path, 'wb')
+        self.buffer = b''
+
+
+    def write(self, data):
+
+        if isinstance(data, str):
+            data = data.encode()
+        data = self.buffer+data
+        start = 0
+        while len(data)-start >= self.BLOCK_SIZE:
+            self.write_block(data[start:start+self.BLOCK_SIZE])
+            start += self.BLOCK_SIZE
+        self.buffer = data[start:]
+
+
+    def write_block(self, data):
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data)+compressor.flush()
+        self.file.write(b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'+struct.pack('<H', len(cdata)+25))
+        self.file.write(cdata)
+        self.file.write(struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data)))
+
+
+    def close(self):
+
+        if self.buffer:
+            self.write_block(self.buffer)
+            self.buffer = b''
+        self.write_block(b'')
+        self.file.close()
@@ -0,0 +1,142 @@
+##############################################################
+#
+# bitsets.py
+#
+# Keep per-window deletion calls (zeros from CNV_Match.py,
+# values below the cut-off from find_deletion_windows.py) as
+# packed bitsets, one bit per progeny, and answer AND / OR /
+# popcount queries on them: the progenies deleted in a set of
+# windows, or the windows deleted in at least K progenies of
+# a subset.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import sys
+
+import numpy as np
+
+# byte -> number of its bits that are set
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+# Rows of at most BLOCK_SIZE bytes are counted at once.
+BLOCK_SIZE = 1 << 22
+
+
+def pack(mask):
+
+    # A 2-D bool array as packed rows, eight columns to a byte, the first column in the highest bit.
+    return np.packbits(np.asarray(mask, dtype=bool), axis=1)
+
+
+def popcount(bits, mask=None):
+
+    # Number of set bits in each row of BITS, only counting the columns set in MASK (a packed row) if given.
+    counts = np.empty(bits.shape[0], dtype=np.int64)
+    rows = max(1, BLOCK_SIZE//max(bits.shape[1], 1))
+    for first in range(0, bits.shape[0], rows):
+        block = bits[first:first+rows]
+        if mask is not None:
+            block = block & mask
+        counts[first:first+rows] = POPCOUNT[block].sum(axis=1)
+
+    return counts
+
+
+class Bit_matrix:
+
+    def __init__(self, chrom_names, chroms, positions, bits, progenies, kind='zero_calls'):
+
+        # matrix structure:
+        # chrom_names: chromosomes -> chroms: index into chrom_names of each row; positions: window location of each row
+        # bits: one packed row per window, one bit per progeny in the order of PROGENIES, set where the progeny is deleted
+        # kind: what the bits are, 'zero_calls' or 'below_cut_off'
+        self.chrom_names = list(chrom_names)
+        self.chroms = np.asarray(chroms, dtype=np.uint16)
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.bits = np.asarray(bits, dtype=np.uint8)
+        self.progenies = list(progenies)
+        self.kind = kind
+        self.rows = None
+
+
+    def row(self, chrom, pos):
+
+        # The row of the window of CHROM at location POS, or -1.
+        if self.rows is None:
+            self.rows = {(self.chrom_names[code], pos): row for row, (code, pos) in enumerate(zip(self.chroms.tolist(), self.positions.tolist()))}
+
+        return self.rows.get((chrom, pos), -1)
+
+
+    def columns(self, progenies):
+
+        # The column numbers of the progeny names, in the given order.
+        column_of = {name: column for column, name in enumerate(self.progenies)}
+        missing = [name for name in progenies if name not in column_of]
+        if missing:
+            sys.stderr.write('Error: No progeny {0}.\n'.format(', '.join(missing)))
+            sys.exit(1)
+
+        return [column_of[name] for name in progenies]
+
+
+    def subset(self, progenies):
+
+        # A packed row with the bits of PROGENIES set, to AND with the rows.
+        mask = np.zeros((1, len(self.progenies)), dtype=bool)
+        mask[0, self.columns(progenies)] = True
+        return pack(mask)[0]
+
+
+    def counts(self, progenies=None):
+
+        # Number of deleted progenies (of PROGENIES if given) in each window.
+        return popcount(self.bits, None if progenies is None else self.subset(progenies))
+
+
+    def windows_with(self, num, progenies=None):
+
+        # Rows of the windows deleted in at least NUM progenies (of PROGENIES if given), in row order.
+        return np.flatnonzero(self.counts(progenies) >= num)
+
+
+    def combine(self, rows, how='and'):
+
+        # The packed row of the progenies deleted in all (how='and') or any (how='or') of ROWS.
+        rows = np.asarray(rows, dtype=np.int64)
+        if not rows.size:
+            return np.zeros(self.bits.shape[1], dtype=np.uint8)
+        function = np.bitwise_and if how == 'and' else np.bitwise_or
+        return function.reduce(self.bits[rows], axis=0)
+
+
+    def progenies_in(self, rows, how='and'):
+
+        # Names of the progenies deleted in all (how='and') or any (how='or') of ROWS.
+        columns = np.flatnonzero(np.unpackbits(self.combine(rows, how))[:len(self.progenies)])
+        return [self.progenies[column] for column in columns.tolist()]
+
+
+    def window(self, row):
+
+        return (self.chrom_names[self.chroms[row]], int(self.positions[row]))
+
+
+    def save(self, file_path):
+
+        with open(file_path, 'wb') as file:
+            np.savez(file, kind=np.array(self.kind), chrom_names=np.array(self.chrom_names, dtype=str), chroms=self.chroms,
+                     positions=self.positions, bits=self.bits, progenies=np.array(self.progenies, dtype=str))
+
+
+def load(file_path):
+
+    try:
+        with np.load(file_path, allow_pickle=False) as saved:
+            return Bit_matrix(saved['chrom_names'].tolist(), saved['chroms'], saved['positions'], saved['bits'],
+                              saved['progenies'].tolist(), str(saved['kind']))
+    except (OSError, ValueError, KeyError):
+        sys.stderr.write('Error in "{0}": Unexpected data format.\n'.format(file_path))
+        sys.exit(1)
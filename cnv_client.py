@@ -0,0 +1,71 @@
+##############################################################
+#
+# cnv_client.py
+#
+# Run find_deleted_genes.py, CNV_in_gene.py or CNV_in_core.py
+# in a running cnv_server.py, which keeps the genes of the gff
+# files and the core regions loaded between runs. Takes the
+# script name, then the same arguments as the script; the
+# output files are written in the current directory, as the
+# script writes them.
+#
+# Only the standard library is imported, so a run starts fast.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import argparse, json, os, socket, sys, tempfile
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'cnv_server_{0}.sock'.format(os.getuid()))
+
+SCRIPTS = ['find_deleted_genes', 'CNV_in_gene', 'CNV_in_core']
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Run a step of Method1 or Method2 in a running cnv_server.py.')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket of the server. Default = {0}'.format(DEFAULT_SOCKET))
+    parser.add_argument('--stop', action='store_true', help='Stop the server')
+    parser.add_argument('script', nargs='?', choices=SCRIPTS, help='The script to run, without .py')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='The arguments of the script')
+
+    args = parser.parse_args()
+    if not args.stop and args.script is None:
+        parser.error('Give a script to run, or --stop.')
+
+    return args
+
+
+def send(socket_path, message):
+
+    # Sends MESSAGE as one line of JSON and returns the reply, also one line of JSON.
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        sys.stderr.write('Error: No server at "{0}", start one with python3 cnv_server.py.\n'.format(socket_path))
+        sys.exit(1)
+
+    with client, client.makefile('rwb') as stream:
+        stream.write(json.dumps(message).encode()+b'\n')
+        stream.flush()
+        reply = stream.readline()
+
+    if not reply:
+        sys.stderr.write('Error: The server at "{0}" closed the connection.\n'.format(socket_path))
+        sys.exit(1)
+
+    return json.loads(reply.decode())
+
+
+# Main flow
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.stop:
+        send(args.socket, {'stop': True})
+    else:
+        reply = send(args.socket, {'script': args.script, 'arguments': args.arguments, 'cwd': os.getcwd()})
+        sys.stdout.write(reply['stdout'])
+        sys.stderr.write(reply['stderr'])
+        sys.exit(reply['status'])
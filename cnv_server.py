@@ -0,0 +1,174 @@
+##############################################################
+#
+# cnv_server.py
+#
+# Keep the genes of gff files and the core regions loaded, and
+# run find_deleted_genes.py, CNV_in_gene.py and CNV_in_core.py
+# for cnv_client.py over a local Unix socket, so a run does
+# not pay for starting Python and building the gene index.
+# Requests are lines of JSON and are served one at a time;
+# genes and cores are loaded again when their file changes.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import argparse, contextlib, io, json, os, socket, socketserver, sys, traceback
+from collections import OrderedDict
+
+import metrics
+import find_deleted_genes, CNV_in_gene, CNV_in_core
+from cnv_client import DEFAULT_SOCKET
+
+# The script modules cnv_client.py can run, and the argument of their main() that loads the index.
+SCRIPTS = {'find_deleted_genes': (find_deleted_genes, 'load_gene_bank'),
+           'CNV_in_gene': (CNV_in_gene, 'load_gene_bank'),
+           'CNV_in_core': (CNV_in_core, 'load_cores')}
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Serve find_deleted_genes.py, CNV_in_gene.py and CNV_in_core.py runs to cnv_client.py, keeping the genes and core regions loaded.')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket to listen on. Default = {0}'.format(DEFAULT_SOCKET))
+    parser.add_argument('--cache_size', type=int, default=16, help='Number of gene banks and core files kept loaded; the least recently used go first. Default = 16')
+
+    args = parser.parse_args()
+    if args.cache_size < 1:
+        parser.error('--cache_size must be at least 1.')
+
+    return args
+
+
+class Index_cache:
+
+    def __init__(self, size):
+
+        # items structure:
+        # (loader, file path, other arguments) -> (size and modification time of the file, loaded index),
+        # the most recently used last
+        self.size = size
+        self.items = OrderedDict()
+
+
+    def loader(self, load):
+
+        # A function taking the arguments of LOAD (a file path first) that returns the index kept for them,
+        # loading it again if the file changed.
+        def cached(file_path, *arguments):
+
+            file_path = os.path.abspath(file_path)
+            stat = os.stat(file_path)
+            stamp = (stat.st_size, stat.st_mtime_ns)
+            key = (load.__module__, load.__name__, file_path)+arguments
+
+            item = self.items.pop(key, None)
+            if item is None or item[0] != stamp:
+                item = (stamp, load(file_path, *arguments))
+            self.items[key] = item
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+            return item[1]
+
+        return cached
+
+
+def run_script(script, arguments, cwd, cache):
+
+    # Runs SCRIPT with ARGUMENTS in the directory CWD, as python3 SCRIPT.py ARGUMENTS would,
+    # and returns its exit status with what it printed.
+    module, load_name = SCRIPTS[script]
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    status = 0
+
+    # The scripts read sys.argv and print to sys.stdout and sys.stderr, so requests are served one at a time.
+    argv = sys.argv
+    directory = os.getcwd()
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                os.chdir(cwd)
+                sys.argv = [script+'.py']+list(arguments)
+                args = module.parse_args()
+                stats = metrics.from_args(args)
+                load = module.Gene_bank if load_name == 'load_gene_bank' else module.read_cores
+                module.main(args, stats, **{load_name: cache.loader(load)})
+                stats.write()
+            except SystemExit as error:
+                if isinstance(error.code, int):
+                    status = error.code
+                elif error.code is not None:
+                    sys.stderr.write('{0}\n'.format(error.code))
+                    status = 1
+            except Exception:
+                traceback.print_exc()
+                status = 1
+    finally:
+        sys.argv = argv
+        os.chdir(directory)
+
+    return {'status': status, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode())
+            except ValueError:
+                reply = {'status': 1, 'stdout': '', 'stderr': 'Error: The request is not JSON.\n'}
+            else:
+                if request.get('stop'):
+                    self.server.stopping = True
+                    reply = {'status': 0, 'stdout': '', 'stderr': ''}
+                elif request.get('script') not in SCRIPTS:
+                    reply = {'status': 1, 'stdout': '', 'stderr': 'Error: No script "{0}".\n'.format(request.get('script'))}
+                else:
+                    reply = run_script(request['script'], request.get('arguments', []), request.get('cwd', '.'), self.server.cache)
+
+            self.wfile.write(json.dumps(reply).encode()+b'\n')
+            self.wfile.flush()
+
+
+def serve(socket_path, cache_size):
+
+    # A socket file left by a server that is gone is removed; a live one is an error.
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.remove(socket_path)
+        else:
+            sys.stderr.write('Error: A server is already running at "{0}".\n'.format(socket_path))
+            sys.exit(1)
+        finally:
+            probe.close()
+
+    # Only the user who started the server can connect.
+    old_mask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(socket_path, Handler)
+    finally:
+        os.umask(old_mask)
+
+    server.cache = Index_cache(cache_size)
+    server.stopping = False
+    sys.stderr.write('Serving on "{0}".\n'.format(socket_path))
+
+    try:
+        while not server.stopping:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+# Main flow
+if __name__ == '__main__':
+    args = parse_args()
+    serve(args.socket, args.cache_size)
@@ -0,0 +1,77 @@
+##############################################################
+#
+# columnar.py
+#
+# Write and read the result tables of Method1 (deletion
+# windows, deleted genes, deleted core genes) as npz files
+# with one typed array per column, so the next script loads
+# them without parsing text.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import sys
+
+import numpy as np
+
+# kind -> the columns of a table of that kind, next to the chromosome codes
+COLUMNS = {'deletion_windows': ['begins', 'ends', 'counts'],
+           'deleted_genes': ['begins', 'ends', 'gene_ids'],
+           'deleted_core_genes': ['begins', 'ends', 'gene_ids']}
+
+
+def is_table(file_path):
+
+    # npz files are zip archives.
+    with open(file_path, 'rb') as file:
+        return file.read(4) == b'PK\x03\x04'
+
+
+def write_table(file_path, kind, chroms, begins, ends, values):
+
+    # One row per entry; CHROMS holds the chromosome names, VALUES the counts or gene IDs.
+    # table structure:
+    # chrom_names: chromosomes in the order they first appear
+    # chroms: chromosome code of each row, an index into chrom_names
+    chrom_codes = {}
+    for chrom in chroms:
+        chrom_codes.setdefault(chrom, len(chrom_codes))
+
+    value_type = np.int64 if kind == 'deletion_windows' else str
+    columns = {'begins': np.array(begins, dtype=np.int64), 'ends': np.array(ends, dtype=np.int64), COLUMNS[kind][2]: np.array(values, dtype=value_type)}
+
+    with open(file_path, 'wb') as file:
+        np.savez(file, kind=np.array(kind), chrom_names=np.array(list(chrom_codes), dtype=str),
+                 chroms=np.array([chrom_codes[chrom] for chrom in chroms], dtype=np.uint16), **columns)
+
+
+def read_table(file_path, kind, region=None):
+
+    # Returns (chrom_names, chroms, begins, ends, values), only the rows overlapping REGION if given.
+    try:
+        with np.load(file_path, allow_pickle=False) as table:
+            if str(table['kind']) != kind:
+                sys.stderr.write('Error in "{0}": Holds {1}, not {2}.\n'.format(file_path, table['kind'], kind))
+                sys.exit(1)
+            chrom_names = table['chrom_names'].tolist()
+            chroms = table['chroms']
+            begins = table['begins']
+            ends = table['ends']
+            values = table[COLUMNS[kind][2]]
+    except (OSError, ValueError, KeyError):
+        sys.stderr.write('Error in "{0}": Unexpected data format.\n'.format(file_path))
+        sys.exit(1)
+
+    if region is not None:
+        if region[0] in chrom_names:
+            kept = chroms == chrom_names.index(region[0])
+        else:
+            kept = np.zeros(chroms.size, dtype=bool)
+        if region[1] is not None:
+            kept &= ends >= region[1]
+        if region[2] is not None:
+            kept &= begins <= region[2]
+        chroms, begins, ends, values = chroms[kept], begins[kept], ends[kept], values[kept]
+
+    return (chrom_names, chroms, begins, ends, values)
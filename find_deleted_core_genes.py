@@ -15,11 +15,17 @@
 import argparse, io, sys, os
 from collections import defaultdict
 
+import columnar, metrics
+from intervals import Interval_index, parse_region, in_region, widen_region
+
 def parse_args():
 
     parser = argparse.ArgumentParser(description='Find genes in the potential deletion windows.')
     parser.add_argument('gene_file', help='The deleted gene file')
     parser.add_argument('core_genome_file', help='Core_gemone file')
+    parser.add_argument('--region', type=parse_region, help='Only looks at the genes and core regions overlapping REGION, written CHROM or CHROM:BEGIN-END, for example Pf3D7_05_v3:100000-120000')
+    parser.add_argument('--columnar', action='store_true', help='Write deleted_core_genes.npz, a table with one typed column per field, instead of deleted_core_genes.txt')
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -30,46 +36,107 @@ def parse_args():
     return args
 
 
-def read_data(file_path):
+def read_data(file_path, region=None):
 
     # data struction:
     # 1st dict key: chromosome -> 2nd dict key: tuple(begin location, end location) -> gene ID or 'Core'
     data = defaultdict(lambda: defaultdict(tuple))
 
+    # deleted_genes.npz, as written by find_deleted_genes.py --columnar.
+    if columnar.is_table(file_path):
+        chrom_names, chroms, begins, ends, gene_ids = columnar.read_table(file_path, 'deleted_genes', region)
+        for chrom, loc_beg, loc_end, gene_id in zip(chroms.tolist(), begins.tolist(), ends.tolist(), gene_ids.tolist()):
+            data[chrom_names[chrom]][(loc_beg, loc_end)] = gene_id
+        return data
+
     file = io.open(file_path)
 
     for line in file:
         if line[0] != 'P':
             continue
         split_line = line.split()
-        data[split_line[0]][(int(split_line[1]), int(split_line[2]))]=split_line[3]
+        if in_region(region, split_line[0], int(split_line[1]), int(split_line[2])):
+            data[split_line[0]][(int(split_line[1]), int(split_line[2]))]=split_line[3]
 
     file.close()
 
     return data
 
-def find_core_genes(core_genome, genes):
-    
-    file = open('deleted_core_genes.txt', 'w')
+def index_cores(core_genome):
+
+    # Interval_index over all the core regions of CORE_GENOME.
+    chroms = []
+    locs = []
+    for chrom in core_genome:
+        for core_loc in core_genome[chrom]:
+            chroms.append(chrom)
+            locs.append(core_loc)
+
+    return Interval_index(chroms, [loc[0] for loc in locs], [loc[1] for loc in locs])
+
+
+def search_core_genes(core_genome, genes):
+
+    # core_genes structure:
+    # (chromosome, gene location tuple(begin location, end location), gene ID), once for every core region the gene overlaps
+    core_genes = []
+    cores = index_cores(core_genome)
+
+    for chrom in sorted(genes.keys()):
+        gene_locs = sorted(genes[chrom].keys())
+
+        counts = cores.count(chrom, [loc[0] for loc in gene_locs], [loc[1] for loc in gene_locs])
+        for gene_loc, count in zip(gene_locs, counts.tolist()):
+            for n in range(count):
+                core_genes.append((chrom, gene_loc, genes[chrom][gene_loc]))
 
-    if genes:
+    return core_genes
+
+
+def write_core_genes(core_genes, header=True, file_path='deleted_core_genes.txt'):
+
+    file = open(file_path, 'w')
+
+    if header:
         file.write('deleted_core_genes:\n')
         file.write('{0:11}  {1:8} {2:8} {3}\n'.format('Chromosome', 'begin', 'end', 'gene ID'))
 
-        for chrom in sorted(genes.keys()):
-            for gene_loc in sorted(genes[chrom].keys()):
-                if chrom in core_genome:
-                    for core_loc in core_genome[chrom]:
-                        if gene_loc[0] > core_loc[1] or gene_loc[1] < core_loc[0]:
-                            continue
-                        
-                        file.write('{0:11}  {1:8} {2:8} {3}\n'.format(chrom, gene_loc[0], gene_loc[1], genes[chrom][gene_loc]))
+        for chrom, gene_loc, gene_id in core_genes:
+            file.write('{0:11}  {1:8} {2:8} {3}\n'.format(chrom, gene_loc[0], gene_loc[1], gene_id))
 
     file.close()
 
+
+def write_core_genes_table(core_genes, file_path='deleted_core_genes.npz'):
+
+    columnar.write_table(file_path, 'deleted_core_genes', [row[0] for row in core_genes], [row[1][0] for row in core_genes],
+                         [row[1][1] for row in core_genes], [row[2] for row in core_genes])
+
+
+def find_core_genes(core_genome, genes):
+    
+    write_core_genes(search_core_genes(core_genome, genes), bool(genes))
+
      
 # Main flow
-args = parse_args()
-genes = read_data(args.gene_file)
-core_genome = read_data(args.core_genome_file)
-find_core_genes(core_genome, genes)
+if __name__ == '__main__':
+    args = parse_args()
+    stats = metrics.from_args(args)
+
+    # Genes reaching out of the region keep the core regions they overlap there.
+    with stats.stage('read_data'):
+        genes = read_data(args.gene_file, args.region)
+        longest = max([loc[1]-loc[0] for chrom in genes for loc in genes[chrom]]+[0])
+        core_genome = read_data(args.core_genome_file, widen_region(args.region, longest))
+
+    with stats.stage('search_core_genes'):
+        core_genes = search_core_genes(core_genome, genes)
+    stats.count('gene_queries', sum(len(genes[chrom]) for chrom in genes))
+    stats.count('core_matches', len(core_genes))
+
+    with stats.stage('write_core_genes'):
+        if args.columnar:
+            write_core_genes_table(core_genes)
+        else:
+            write_core_genes(core_genes, bool(genes))
+    stats.write()
@@ -11,14 +11,21 @@
 #
 #############################################
 
-import argparse, io, sys, os
+import argparse, io, os
 from collections import defaultdict
 
+import columnar, gff_cache, metrics
+from intervals import Interval_index, parse_region, in_region, widen_region
+
 def parse_args():
 
     parser = argparse.ArgumentParser(description='Find genes in the potential deletion windows.')
     parser.add_argument('window_file', help='The potential deletion windows file')
     parser.add_argument('genome_file', help='Gemone file from "http://plasmodb.org/common/downloads/Current_Release/Pfalciparum3D7/gff/data/"')
+    parser.add_argument('--region', type=parse_region, help='Only looks at the windows and genes overlapping REGION, written CHROM or CHROM:BEGIN-END, for example Pf3D7_05_v3:100000-120000')
+    parser.add_argument('--no_cache', action='store_true', help='Parse the genome file again instead of reading or writing its gene cache (GENOME_FILE.genes.npz)')
+    parser.add_argument('--columnar', action='store_true', help='Write deleted_genes.npz, a table with one typed column per field, instead of deleted_genes.txt')
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -29,19 +36,27 @@ def parse_args():
     return args
 
 
-def read_data(file_path):
+def read_data(file_path, region=None):
 
     # deletions structure:
     # 1st dict key: chromosome -> 2nd dict key: window begin location -> 3rd dict key: window end location -> number of deletions
     deletions = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
 
+    # deletion_windows.npz, as written with --columnar.
+    if columnar.is_table(file_path):
+        chrom_names, chroms, begins, ends, counts = columnar.read_table(file_path, 'deletion_windows', region)
+        for chrom, loc_beg, loc_end, count in zip(chroms.tolist(), begins.tolist(), ends.tolist(), counts.tolist()):
+            deletions[chrom_names[chrom]][loc_beg][loc_end] = count
+        return deletions
+
     file = io.open(file_path)
     file.readline()
     file.readline()
 
     for line in file:
         split_line = line.split()
-        deletions[split_line[0]][int(split_line[1])][int(split_line[2])]=split_line[3]
+        if in_region(region, split_line[0], int(split_line[1]), int(split_line[2])):
+            deletions[split_line[0]][int(split_line[1])][int(split_line[2])]=split_line[3]
 
     file.close()
 
@@ -50,113 +65,121 @@ def read_data(file_path):
      
 class Gene_bank:
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, cache=True, region=None):
 
 
         # gene_bank structure:
-        # 1st dict key: chrom -> 2nd dict key: gene_begin location//10000 -> 3rd dict key: (gene_begin location, gene_end location) -> gene ID        
-        self.gene_bank = defaultdict(lambda: defaultdict(dict))
+        # gene_bank: Interval_index over all the genes -> gene number
+        # genes: gene number -> (gene_begin location, gene_end location, gene ID)
+        self.genes = []
         
-        self.build_gene_bank(file_path)
+        self.build_gene_bank(file_path, cache, region)
         
 
-    def build_gene_bank(self, file_path):
-        
-        file = io.open(file_path)
-        
-        for line in file:
-            
-            if line[0] == '#':
-                continue
-
-            if not line.startswith('Pf'):
-                sys.stderr.write('Error in "{0}": Unexpected data format.\n'.format(file_path))
-                sys.exit(1)
-            
-            split_line = line.split()
-            if split_line[2] == 'gene':
-                loc_chrom = split_line[0]
-                loc_beg = split_line[3]
-                loc_end = split_line[4]
-                gene_id = split_line[-1]
-
-                if not loc_beg or not loc_end:
-                    continue
-                
-                loc_beg = int(loc_beg)
-                loc_end = int(loc_end)
+    def build_gene_bank(self, file_path, cache=True, region=None):
         
-                code_beg = loc_beg//10000
-                code_end = loc_end//10000     
-                
-                chrom = self.gene_bank[loc_chrom]
-                chrom[code_beg][(loc_beg, loc_end)] = gene_id
-
-                # If a gene spans the edges of two buckets, then it is added in both.
-                if code_beg != code_end:                    
+        chroms, begins, ends, attributes = gff_cache.read_genes(file_path, cache)
+        if region is not None:
+            chroms, begins, ends, attributes = gff_cache.select_genes(chroms, begins, ends, attributes, region)
 
-                    chrom[code_end][(loc_beg, loc_end)] = gene_id
-
-        file.close()
+        # The gene ID is the last word of the attributes.
+        self.genes = [(loc_beg, loc_end, gene_id.split()[-1]) for loc_beg, loc_end, gene_id in zip(begins, ends, attributes)]
+        self.gene_bank = Interval_index(chroms, begins, ends)
         
         
-    def search_genes(self, loc_chrom, loc_beg, loc_end):
+    def search_genes(self, loc_chrom, loc_begs, loc_ends):
 
+        # Takes all the windows of a chromosome at once.
         # genes structure:
-        # genes key: gene location tuple(begin location, end location) -> gene ID
-        genes = {}
+        # one dict per window: gene location tuple(begin location, end location) -> gene ID
+        genes = [{} for loc_beg in loc_begs]
 
-        chrom = self.gene_bank[loc_chrom]
-        code_beg = loc_beg//10000
-        code_end = loc_end//10000
-        
-        if code_beg in chrom:
-            for loc in chrom[code_beg]:
-                
-                if loc[0]>loc_end or loc[1]<loc_beg:
-                    continue
-                genes[loc] = chrom[code_beg][loc]
-                
-        if code_beg != code_end:
-            if code_end in chrom:
-                for loc in chrom[code_end]:
-                    
-                    if loc[0]>loc_end or loc[1]<loc_beg:
-                        continue
-                    genes[loc] = chrom[code_end][loc]
+        for window, gene in zip(*self.gene_bank.search(loc_chrom, loc_begs, loc_ends)):
+            loc_beg, loc_end, gene_id = self.genes[gene]
+            genes[window][(loc_beg, loc_end)] = gene_id
                     
         return genes
 
         
               
-def find_deleted_genes(gene_bank, deletes):
+def search_deleted_genes(gene_bank, deletes):
+
+    # hits structure:
+    # one (chromosome, genes) pair per window, in the order of the output file; genes as returned by search_genes
+    hits = []
+
+    for chrom in sorted(deletes.keys()):
+        windows = [(loc_beg, loc_end) for loc_beg in sorted(deletes[chrom].keys()) for loc_end in sorted(deletes[chrom][loc_beg].keys())]
+        
+        for genes in gene_bank.search_genes(chrom, [window[0] for window in windows], [window[1] for window in windows]):
+            hits.append((chrom, genes))
+
+    return hits
+
 
-    file = open('deleted_genes.txt', 'w')
+def write_deleted_genes(hits, file_path='deleted_genes.txt'):
+
+    file = open(file_path, 'w')
     
-    if deletes:
+    if hits:
         file.write('deleted_genes:\n')
         file.write('{0:11}  {1:8} {2:8} {3}\n'.format('Chromosome', 'begin', 'end', 'gene ID'))
         
-        for chrom in sorted(deletes.keys()):
-            for loc_beg in sorted(deletes[chrom].keys()):
-                for loc_end in sorted(deletes[chrom][loc_beg].keys()):
-            
-                    genes = gene_bank.search_genes(chrom, loc_beg, loc_end)
-
-                    if genes:
-                        
-                        for loc in genes:
-                             
-                            file.write('{0:11}  {1:8} {2:8} {3}\n'.format(chrom, loc[0], loc[1], genes[loc]))
-                    else:
-                        file.write('No gene is found in this region\n\n')
+        for chrom, genes in hits:
+
+            if genes:
+                
+                for loc in genes:
+                     
+                    file.write('{0:11}  {1:8} {2:8} {3}\n'.format(chrom, loc[0], loc[1], genes[loc]))
+            else:
+                file.write('No gene is found in this region\n\n')
     else:
         file.write("There's no deleted gene.")          
 
+    file.close()
+
+
+def write_deleted_genes_table(hits, file_path='deleted_genes.npz'):
+
+    # One row per gene found in a window, in the order of write_deleted_genes.
+    rows = [(chrom, loc[0], loc[1], genes[loc]) for chrom, genes in hits for loc in genes]
+    columnar.write_table(file_path, 'deleted_genes', [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows], [row[3] for row in rows])
+
+              
+def find_deleted_genes(gene_bank, deletes):
+
+    write_deleted_genes(search_deleted_genes(gene_bank, deletes))
+
+
+
+def main(args, stats=metrics.NULL, load_gene_bank=Gene_bank):
+
+    # LOAD_GENE_BANK takes the arguments of Gene_bank; cnv_server.py passes one that keeps the banks it built.
+    # Windows reaching out of the region keep the genes they overlap there, so the genes are taken
+    # from the region widened by the longest window.
+    with stats.stage('read_data'):
+        deletes = read_data(args.window_file, args.region)
+    longest = max([loc_end-loc_beg for chrom in deletes for loc_beg in deletes[chrom] for loc_end in deletes[chrom][loc_beg]]+[0])
+    with stats.stage('gene_bank'):
+        gene_bank = load_gene_bank(args.genome_file, not args.no_cache, widen_region(args.region, longest))
+    stats.count('genes', len(gene_bank.genes))
+
+    with stats.stage('search_genes'):
+        hits = search_deleted_genes(gene_bank, deletes)
+    stats.count('gene_queries', len(hits))
+    stats.count('gene_hits', sum(len(genes) for chrom, genes in hits))
+
+    with stats.stage('write_deleted_genes'):
+        if args.columnar:
+            write_deleted_genes_table(hits)
+        else:
+            write_deleted_genes(hits)
 
 
 # Main flow
-args = parse_args()
-deletes = read_data(args.window_file)
-gene_bank = Gene_bank(args.genome_file)
-find_deleted_genes(gene_bank, deletes)
+if __name__ == '__main__':
+    args = parse_args()
+    stats = metrics.from_args(args)
+    main(args, stats)
+    stats.write()
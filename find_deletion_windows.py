@@ -13,8 +13,25 @@
 #
 ###############################################################
 
-import argparse, io, sys, os
-import collections
+import argparse, sys, os
+import hashlib
+import multiprocessing
+import tempfile
+
+import numpy as np
+
+import bin_reader, bitsets, columnar, metrics, quantile_sketch
+from intervals import parse_region
+
+# --storage -> type of the data matrix.
+# fixed16 keeps round(value*FIXED_SCALE) in a uint16, the 5 decimals of the bin files, and every value
+# of FIXED_MAX/FIXED_SCALE or more as FIXED_MAX.
+STORAGE = {'float64': np.float64, 'float32': np.float32, 'fixed16': np.uint16}
+FIXED_SCALE = 100000
+FIXED_MAX = 65535
+
+# Where the matrix shared by the processes of -j is written, memory rather than a disk where there is one.
+SHARED_DIRECTORY = '/dev/shm' if os.path.isdir('/dev/shm') else None
 
 def parse_args():
     
@@ -23,6 +40,17 @@ def parse_args():
     parser.add_argument('--cut_off', '-c', type=float, required = False, default=0.01, help='Only condsiders values below CUT_OFF as potential deletions. Default = 0.01')
     parser.add_argument('--low_bound', '-l', type=int, required = False, default=3, help='Only returns results of at least LOW_BOUND consecutive windows. Default = 3')
     parser.add_argument('--interval', '-i', type=int, required = False, nargs = 2, help='Only considers windows with numbers of deletions within the interval. Default = [10, 40]. Example input: 10 40')
+    parser.add_argument('--jobs', '-j', type=int, required = False, default=1, help='Number of processes that read the data files, then find the cut-offs and runs of blocks of progenies, sharing one copy of the data. Default = 1')
+    parser.add_argument('--prefetch', type=int, required = False, default=bin_reader.PREFETCH_FILES, help='With one job, number of data files read at once in background threads while they are parsed in order. 0 reads them in turn. Default = {0}'.format(bin_reader.PREFETCH_FILES))
+    parser.add_argument('--region', '--chrom', type=parse_region, required = False, help='Only reads and searches the windows overlapping REGION, written CHROM or CHROM:BEGIN-END, for example Pf3D7_05_v3:100000-120000. Cut-offs come from the state if --state is given, else from those windows only')
+    parser.add_argument('--state', required = False, help='State file keeping the cut-off values and runs of every progeny. Only progenies missing from it are searched, then it is updated. With --region, its cut-off values are used and it is not updated')
+    parser.add_argument('--columnar', action='store_true', required = False, help='Write deletion_windows.npz, a table with one typed column per field, instead of deletion_windows.txt')
+    parser.add_argument('--bits', '-b', required = False, help='Also write the values no bigger than the cut-off to BITS, a bit matrix with one bit per progeny and window that query_deletions.py reads. Not taken with --state unless --region is given')
+    parser.add_argument('--storage', choices=list(STORAGE), required = False, default='float32', help='How the values are kept in memory: float64 (8 bytes), float32 (4 bytes) or fixed16 (2 bytes, values with at most 5 decimals, cut-off values below 0.65535). Default = float32')
+    parser.add_argument('--sketch', type=float, required = False, help='Estimate the cut-off values while the data files are read, each within SKETCH (relative error, for example 0.01) of the exact one, with memory that does not grow with the number of windows. The error is written to stderr. Not taken with --state')
+    parser.add_argument('--out_of_core', required = False, help='Keep the data in a file in the directory OUT_OF_CORE instead of memory, and search it CHUNK_WINDOWS windows at a time. The output is the same. Not taken with -j or --state')
+    parser.add_argument('--chunk_windows', type=int, required = False, default=4096, help='With --out_of_core, number of windows read from the file at once. Default = 4096')
+    metrics.add_arguments(parser)
     
     args = parser.parse_args()
     paths = list(args.data_file)
@@ -33,128 +61,832 @@ def parse_args():
 
     if not args.interval:
         args.interval = [10, 40]
+    if args.bits and args.state and not args.region:
+        parser.error('--bits cannot be used with --state unless --region is given.')
+    if args.sketch is not None and args.state:
+        parser.error('--sketch cannot be used with --state.')
+    if args.sketch is not None and not 0 < args.sketch < 1:
+        parser.error('--sketch must be between 0 and 1.')
+    if args.out_of_core is not None:
+        if args.jobs > 1 or args.state:
+            parser.error('--out_of_core cannot be used with -j or --state.')
+        if not os.path.isdir(args.out_of_core):
+            parser.error('Directory "{0}" cannot be found.'.format(args.out_of_core))
+    if args.chunk_windows < 1:
+        parser.error('--chunk_windows must be at least 1.')
 
     return args
     
-def read_data(file_paths):
-    
-    data = []
-    info = []
-    for path in file_paths:
-        file = io.open(path)
-        file.readline()
+def map_jobs(function, items, jobs):
 
-        for line in file:
-            split_line = line.split()
-            
-            if not split_line[0].startswith('Pf3D7'):
-                sys.stderr.write('Error in "{0}": Unexpected data format.\n'.format(path))
-                sys.exit(1)
-                
-            if 'API' in split_line[0]:
-                continue
-            
-            for n in range(1, len(split_line)):
-                split_line[n] = float(split_line[n])
+    # Results come back in the order of ITEMS, whatever the number of jobs.
+    if jobs <= 1 or len(items) <= 1:
+        return [function(*item) for item in items]
 
-            info.append((split_line[0][:11], int(split_line[0][12:])*300))    
-            data.append(split_line[1:])
-            
-        file.close()
-        
-    return (data, info)
+    with multiprocessing.Pool(min(jobs, len(items))) as pool:
+        return pool.starmap(function, items, chunksize=1)
+
+
+def to_fixed(values, path):
+
+    # float64 VALUES as fixed16 codes. Below FIXED_MAX the codes give back the values exactly, so they
+    # keep their order and cut-offs found on them are those of the values.
+    codes = np.rint(values*FIXED_SCALE)
+    kept = codes < FIXED_MAX
+    if not (values >= 0).all() or not np.array_equal(codes[kept]/FIXED_SCALE, values[kept]):
+        raise ValueError('Error in "{0}": Values must be positive with at most 5 decimals for --storage fixed16.'.format(path))
+
+    return np.minimum(codes, FIXED_MAX).astype(np.uint16)
+
+
+def as_storage(values, dtype):
+
+    # Cut-off VALUES as they compare to data of DTYPE.
+    if dtype != np.uint16:
+        return np.asarray(values, dtype=dtype)
+
+    codes = np.rint(np.asarray(values, dtype=np.float64)*FIXED_SCALE)
+    if (codes >= FIXED_MAX).any():
+        sys.stderr.write('Error: Cut-off values of {0} or more cannot be told apart with --storage fixed16, use float32.\n'.format(FIXED_MAX/FIXED_SCALE))
+        sys.exit(1)
+
+    return codes.astype(np.uint16)
+
+
+def parse_blocks(path, chrom_names, columns=None, region=None, storage='float32', chunks=None, sketch=None):
+
+    # Yields (values, chroms, positions, line_num) for every block of lines of PATH (from CHUNKS if given), each parsed at once:
+    # values is a 2-D array of the STORAGE type, windows x progenies, holding only the progeny COLUMNS and the windows
+    # of REGION if given; chroms and positions are parallel to its rows, chroms indexing CHROM_NAMES, which is extended
+    # with the chromosomes met; line_num counts the lines of the block, API ones included. A block of API lines only
+    # gives values None. SKETCH, a quantile_sketch.Lower_tail_sketch if given, also counts the values kept.
+    # fixed16 values are parsed as float64 first. A malformed line raises ValueError (see bin_reader.exit_on_error).
+    chrom_codes = {chrom: code for code, chrom in enumerate(chrom_names)}
+    pro_num = None
+    if chunks is None:
+        chunks = bin_reader.read_chunks(path, region)
+    dtype = np.float32 if storage == 'float32' else np.float64
+    usecols = None if columns is None else [column+1 for column in columns]
+    for chunk in chunks:
+        names, values = bin_reader.parse_chunk(chunk, dtype, usecols)
+
+        # Blocks the bulk parser does not take (lines of different lengths, words that are not numbers)
+        # are split line by line. widths holds the number of progenies of every line, COLUMNS or not.
+        if values is None:
+            split_lines = [line.split() for line in chunk.decode().splitlines() if line.strip()]
+            names = [split_line[0] for split_line in split_lines]
+            values = [split_line[1:] for split_line in split_lines]
+            widths = [len(row) for row in values]
+        else:
+            widths = [len(chunk.lstrip().split(b'\n', 1)[0].split())-1]*len(names)
+        line_num = len(names)
+
+        if not all(name.startswith('Pf3D7') for name in names):
+            raise ValueError('Error in "{0}": Unexpected data format.'.format(path))
+
+        kept = ['API' not in name for name in names]
+        if not all(kept):
+            names = [name for name, keep in zip(names, kept) if keep]
+            widths = [width for width, keep in zip(widths, kept) if keep]
+            values = values[np.array(kept, dtype=bool)] if isinstance(values, np.ndarray) else [row for row, keep in zip(values, kept) if keep]
+        if not names:
+            yield (None, None, None, line_num)
+            continue
+
+        # Every row must have the same number of progenies.
+        widths = set(widths)
+        if pro_num is None:
+            pro_num = widths.pop()
+        if widths and widths != {pro_num}:
+            raise ValueError('Error in "{0}": Unexpected data format.'.format(path))
+
+        # Only the progeny COLUMNS are made into numbers; the sketch and fixed16 only see those.
+        if columns is None:
+            values = np.asarray(values, dtype=dtype).reshape(len(names), pro_num)
+        elif not isinstance(values, np.ndarray):
+            values = np.array([[row[column] for column in columns] for row in values], dtype=dtype).reshape(len(names), len(columns))
+        if sketch is not None:
+            sketch.update(values)
+        if storage == 'fixed16':
+            values = to_fixed(values, path)
+
+        bins = bin_reader.decode_bins(names)
+        if bins is None:
+            raise ValueError('Error in "{0}": Unexpected data format.'.format(path))
+        for chrom in bins[0]:
+            if chrom not in chrom_codes:
+                chrom_codes[chrom] = len(chrom_names)
+                chrom_names.append(chrom)
+        chroms = np.array([chrom_codes[chrom] for chrom in bins[0]], dtype=np.uint16)[bins[1]]
+
+        yield (values, chroms, (bins[2]*300).astype(np.int32), line_num)
 
 
-def binary_insert(num, nums):
+def read_file(path, columns=None, region=None, storage='float32', chunks=None, sketch=None):
 
-    l = 0
-    r = len(nums)
-    while l < r:
-        m = l + (r-l)//2
-        if num > nums[m]:
-            l = m+1
+    # data structure:
+    # a 2-D array of the STORAGE type, windows x progenies, holding only the progeny COLUMNS and the windows of REGION if given.
+    # chroms and positions are parallel to the rows of data: chroms holds an index into chrom_names
+    # and positions holds the window location. line_num counts the lines read, API ones included.
+    # SKETCH, a quantile_sketch.Lower_tail_sketch if given, also counts the values kept, and is returned last.
+    blocks = []
+    chrom_names = []
+    chroms = []
+    positions = []
+    line_num = 0
+
+    for values, chrom_block, position_block, block_lines in parse_blocks(path, chrom_names, columns, region, storage, chunks, sketch):
+        line_num += block_lines
+        if values is not None:
+            blocks.append(values)
+            chroms.append(chrom_block)
+            positions.append(position_block)
+
+    if blocks:
+        return (np.concatenate(blocks), np.concatenate(chroms), np.concatenate(positions), chrom_names, line_num, sketch)
+
+    data = np.empty((0, 0 if columns is None else len(columns)), dtype=STORAGE[storage])
+    return (data, np.empty(0, dtype=np.uint16), np.empty(0, dtype=np.int32), chrom_names, line_num, sketch)
+
+
+def read_data(file_paths, jobs=1, columns=None, region=None, stats=metrics.NULL, storage='float32', prefetch=bin_reader.PREFETCH_FILES, sketch=None):
+
+    # Each file is parsed on its own, then the files are stacked in the given order.
+    # With one job, the next files are read in background threads (PREFETCH files at once) while one is parsed.
+    # SKETCH, if given, counts the values of every file; with more jobs each process counts in its own sketch,
+    # and these are added to it.
+    with bin_reader.exit_on_error():
+        if jobs <= 1 or len(file_paths) <= 1:
+            parts = [read_file(path, columns, region, storage, chunks, sketch) for path, chunks in bin_reader.read_files(file_paths, region, prefetch)]
         else:
-            r = m
-    nums.insert(r, num)
+            parts = map_jobs(read_file, [(path, columns, region, storage, None, None if sketch is None else sketch.empty()) for path in file_paths], jobs)
+            if sketch is not None:
+                for part in parts:
+                    sketch.merge(part[5])
+    stats.count('lines_parsed', sum(part[4] for part in parts))
+
+    chrom_names = []
+    chrom_codes = {}
+    pro_num = None
+    for path, part in zip(file_paths, parts):
+        if not part[0].shape[0]:
+            continue
+        if pro_num is None:
+            pro_num = part[0].shape[1]
+        elif part[0].shape[1] != pro_num:
+            sys.stderr.write('Error in "{0}": Unexpected data format.\n'.format(path))
+            sys.exit(1)
+        for chrom in part[3]:
+            if chrom not in chrom_codes:
+                chrom_codes[chrom] = len(chrom_names)
+                chrom_names.append(chrom)
+
+    parts = [part for part in parts if part[0].shape[0]]
+    if not parts:
+        return (np.empty((0, 0 if columns is None else len(columns)), dtype=STORAGE[storage]), np.empty(0, dtype=np.uint16), np.empty(0, dtype=np.int32), chrom_names)
+    if len(parts) == 1:
+        return parts[0][:4]
+
+    data = np.concatenate([part[0] for part in parts])
+    chroms = np.concatenate([np.array([chrom_codes[chrom] for chrom in part[3]], dtype=np.uint16)[part[1]] for part in parts])
+    positions = np.concatenate([part[2] for part in parts])
+
+    return (data, chroms, positions, chrom_names)
+
+
+def read_file_item(item):
+
+    return read_file(*item)
+
+
+def file_blocks(file_paths, chrom_names, columns, region, storage, prefetch, sketch, jobs):
+
+    # Yields (path, values, chroms, positions, line_num) as parse_blocks does, for the data files in the given order.
+    # With JOBS processes each file is parsed whole by read_file in a process, as in read_data, and its chromosome
+    # codes are changed to indexes into CHROM_NAMES as it comes back.
+    # A malformed file stops the run here, also when a worker process found it.
+    with bin_reader.exit_on_error():
+        if jobs <= 1 or len(file_paths) <= 1:
+            for path, chunks in bin_reader.read_files(file_paths, region, prefetch):
+                for block in parse_blocks(path, chrom_names, columns, region, storage, chunks, sketch):
+                    yield (path,)+block
+            return
+
+        items = [(path, columns, region, storage, None, None if sketch is None else sketch.empty()) for path in file_paths]
+        with multiprocessing.Pool(min(jobs, len(items))) as pool:
+            for path, part in zip(file_paths, pool.imap(read_file_item, items)):
+                if sketch is not None:
+                    sketch.merge(part[5])
+                if not part[0].shape[0]:
+                    yield (path, None, None, None, part[4])
+                    continue
+                for chrom in part[3]:
+                    if chrom not in chrom_names:
+                        chrom_names.append(chrom)
+                codes = np.array([chrom_names.index(chrom) for chrom in part[3]], dtype=np.uint16)
+                yield (path, part[0], codes[part[1]], part[2], part[4])
+
+
+def write_data(file_paths, directory=None, region=None, stats=metrics.NULL, storage='float32', prefetch=bin_reader.PREFETCH_FILES, sketch=None,
+               columns=None, jobs=1):
+
+    # Parses the data files in turn into a temporary file of DIRECTORY, a raw windows x progenies matrix of the STORAGE type
+    # with the windows in the order read_data stacks them, holding one block of lines (with JOBS processes, one file)
+    # in memory at a time. Only the progeny COLUMNS are kept if given.
+    # Returns (path, shape, chroms, positions, chrom_names), the matrix to be mapped with Chunk_engine or map_engine.
+    file = tempfile.NamedTemporaryFile(prefix='cnv_data_', suffix='.bin', dir=directory, delete=False)
+    chrom_names = []
+    chroms = []
+    positions = []
+    pro_num = None
+    line_num = 0
+
+    # The file is removed if the run stops before it is written whole (a malformed line, a full disk).
+    try:
+        with file:
+            for path, values, chrom_block, position_block, block_lines in file_blocks(file_paths, chrom_names, columns, region, storage, prefetch, sketch, jobs):
+                line_num += block_lines
+                if values is None:
+                    continue
+                if pro_num is None:
+                    pro_num = values.shape[1]
+                elif values.shape[1] != pro_num:
+                    sys.stderr.write('Error in "{0}": Unexpected data format.\n'.format(path))
+                    sys.exit(1)
+                file.write(np.ascontiguousarray(values).tobytes())
+                chroms.append(chrom_block)
+                positions.append(position_block)
+    except BaseException:
+        os.remove(file.name)
+        raise
+    stats.count('lines_parsed', line_num)
+
+    if not chroms:
+        return (file.name, (0, 0 if columns is None else len(columns)), np.empty(0, dtype=np.uint16), np.empty(0, dtype=np.int32), chrom_names)
+    chroms = np.concatenate(chroms)
+    return (file.name, (chroms.size, pro_num), chroms, np.concatenate(positions), chrom_names)
+
+
+def cut_off_ranks(win_num, cut_offs):
+
+    # The cut-off value of a progeny is its CUT_OFF_NUM-th smallest value.
+    cut_off_nums = [int(win_num*cut_off) for cut_off in cut_offs]
+    for cut_off, cut_off_num in zip(cut_offs, cut_off_nums):
+        if cut_off_num < 1:
+            sys.stderr.write('Error: cut_off {0} selects no window out of {1}.\n'.format(cut_off, win_num))
+            sys.exit(1)
+
+    return cut_off_nums
+
+
+def find_cut_offs(data, cut_offs, win_num=None):
+
+    # One partition over all the progeny columns places every requested rank at once.
+    # WIN_NUM, if given, is the number of windows the ranks are taken from, DATA then holding at least
+    # the smallest values of every progeny up to the largest rank.
+    cut_off_nums = cut_off_ranks(data.shape[0] if win_num is None else win_num, cut_offs)
+    kth = sorted(set(num-1 for num in cut_off_nums))
+    below_cut = np.partition(data, kth, axis=0)
+
+    # cut_off_values structure:
+    # one row per cut_off in CUT_OFFS -> one value per progeny
+    cut_off_values = below_cut[[num-1 for num in cut_off_nums]]
+    if data.dtype == np.uint16:
+        return cut_off_values/FIXED_SCALE
+    return cut_off_values
 
     
 def find_cut_off(data, cut_off):
 
-    win_num = len(data)                         
-    pro_num = len(data[0])
+    return find_cut_offs(data, [cut_off])[0]
 
-    cut_off_num = int(win_num*cut_off)
-    cut_off_values = []
-    
-    for pro in range(pro_num):
 
-        # This keeps up to CUT_OFF_NUM windows sorted. After all the insertion, the last number in the list is the cut_off_value.
-        below_cut = []
-        
-        for win in range(win_num):
-            
-            if len(below_cut) < cut_off_num:
-                binary_insert(data[win][pro], below_cut)
-            else:
-                if data[win][pro] < below_cut[-1]:
-                    below_cut.pop()
-                    binary_insert(data[win][pro], below_cut)
-        cut_off_values.append(below_cut[-1])
-    return cut_off_values
+def sketch_cut_off(sketch, win_num, cut_off):
+
+    # Cut-off values estimated by SKETCH, filled while the data were read. How far they can be from
+    # the exact ones is written to stderr.
+    estimates, lower, upper = sketch.quantile(cut_off_ranks(win_num, [cut_off])[0])
+    widest = int(np.argmax(upper-lower)) if upper.size else 0
+    sys.stderr.write('Cut-off values from a sketch of {0} buckets per progeny, each within {1:.2%} of the exact one. '
+                     'Widest range: [{2:g}, {3:g}].\n'.format(sketch.size, sketch.error, lower[widest] if upper.size else 0, upper[widest] if upper.size else 0))
+
+    return estimates
+
+
+def find_runs(data, cut_off_values, pro_block=256):
+
+    win_num, pro_num = data.shape
+    cut_off_values = as_storage(cut_off_values, data.dtype)
+
+    # runs structure:
+    # (progeny, begin window, end window) of every maximal run of values no bigger than the progeny's cut-off,
+    # ordered by progeny and then by begin window.
+    pros = []
+    begins = []
+    ends = []
+    for first in range(0, pro_num, pro_block):
+        last = min(first+pro_block, pro_num)
+
+        # Pad each progeny with a window above the cut-off on both sides, so every run has an edge to find.
+        below = np.zeros((last-first, win_num+2), dtype=np.int8)
+        below[:, 1:-1] = (data[:, first:last] <= cut_off_values[first:last]).T
+        edges = np.diff(below, axis=1)
+
+        pro, begin = np.nonzero(edges == 1)
+        end = np.nonzero(edges == -1)[1]-1
+        pros.append(pro+first)
+        begins.append(begin)
+        ends.append(end)
+
+    if not pros:
+        return (np.empty(0, dtype=np.int64),)*3
+    return (np.concatenate(pros), np.concatenate(begins), np.concatenate(ends))
+
 
+def interval_nums(begins, ends, win_num, low_bound):
 
-def find_deletes(data, info, cut_off_values, low_bound, interval):
+    # A run [begin, end] holds every interval [start, end] that is at least LOW_BOUND windows long,
+    # and each of them counts as a potential deletion of the progeny.
+    # The last window never starts a counted interval on its own.
+    low = max(low_bound, 1)
+    nums = ends-begins+2-low
+    if low == 1:
+        nums[(begins == ends) & (ends == win_num-1)] = 0
+        nums[(begins < ends) & (ends == win_num-1)] -= 1
+    return np.maximum(nums, 0)
 
-    win_num = len(data)                         
-    pro_num = len(data[0])
 
-    # This stores the interval of potential deletions as key and the number of progenies that contain the deletion as value.
-    dic = collections.defaultdict(int)
+def expand_runs(begins, ends, win_num, low_bound):
+
+    nums = interval_nums(begins, ends, win_num, low_bound)
+    offsets = np.repeat(np.cumsum(nums)-nums, nums)
+    starts = np.repeat(begins, nums)+np.arange(offsets.size)-offsets
+
+    # keys structure:
+    # every interval of every run, in the order of the runs, encoded as start*WIN_NUM+end
+    return starts.astype(np.int64)*win_num+np.repeat(ends, nums)
+
+
+def count_runs(begins, ends, win_num, low_bound):
+
+    # (keys, first, counts): every interval encoded as start*WIN_NUM+end -> the order in which it was first met,
+    # and the number of progenies that contain it
+    return np.unique(expand_runs(begins, ends, win_num, low_bound), return_index=True, return_counts=True)
+
+
+def merge_counts(parts):
+
+    # Joins the (key_num, keys, first, counts) of count_runs on consecutive column blocks, KEY_NUM being the
+    # number of intervals each block expanded, into what count_runs gives on all the columns at once.
+    offsets = np.cumsum([0]+[part[0] for part in parts[:-1]])
+    keys = np.concatenate([part[1] for part in parts])
+    first = np.concatenate([part[2]+offset for part, offset in zip(parts, offsets)])
+    counts = np.concatenate([part[3] for part in parts])
+
+    order = np.lexsort((first, keys))
+    keys, first, counts = keys[order], first[order], counts[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1]))) if keys.size else np.empty(0, dtype=np.int64)
+
+    return (keys[starts], first[starts], np.add.reduceat(counts, starts) if starts.size else counts)
+
+
+def combine_deletes(keys, first, counts, win_num, chroms, positions, chrom_names, interval):
+
     ret = {}
-    for pro in range(pro_num):
-        win = 0
-        begin = end = -1
-        cut_off = cut_off_values[pro]
-
-        # In each progeny, find all the intervals with values no bigger than CUT_OFF.
-        while win < win_num:                      
-                                            
-            if begin < 0 and data[win][pro] <= cut_off:
-                begin = win
-                
-            elif begin >= 0:
-                if data[win][pro] > cut_off:
-                    end = win-1
-                elif win == win_num-1:
-                    end = win
-                if end >= 0:
-                    
-                    # Find intervals that contain at least LOW_BOUND consecutive windows.
-                    if end-begin >= low_bound-1:      
-                        dic[(begin, end)] += 1
-                    win = begin
-                    begin = end = -1
-            win += 1
-
-    for key in dic:
-
-        # Find intervals with numbers of deletions in the interval.
-        if interval[0] < dic[key] < interval[1]:
-
-            # Get the real chromosome location.
-            loc_end = info[key[1]]         
-            loc_beg = info[key[0]]
-
-            # Combine all the intervals ending at the same place.
-            if loc_end not in ret:          
-                ret[loc_end]=(loc_beg, dic[key])
-                
-            elif loc_beg[1] < ret[loc_end][0][1]:
-                ret[loc_end]=(loc_beg, dic[key])
-                
+
+    # Find intervals with numbers of deletions in the interval.
+    selected = (counts > interval[0]) & (counts < interval[1])
+    keys = keys[selected]
+    counts = counts[selected]
+    order = np.argsort(first[selected], kind='stable')
+
+    for key, count in zip(keys[order].tolist(), counts[order].tolist()):
+        begin, end = divmod(key, win_num)
+
+        # Get the real chromosome location.
+        loc_end = (chrom_names[chroms[end]], int(positions[end]))
+        loc_beg = (chrom_names[chroms[begin]], int(positions[begin]))
+
+        # Combine all the intervals ending at the same place.
+        if loc_end not in ret:          
+            ret[loc_end]=(loc_beg, count)
+            
+        elif loc_beg[1] < ret[loc_end][0][1]:
+            ret[loc_end]=(loc_beg, count)
+            
     return ret
 
 
+def below_cut_off_bits(data, chroms, positions, chrom_names, cut_off_values, progenies, block=1 << 16):
+
+    # The calls find_runs makes (values no bigger than the progeny's cut-off) as a bitsets.Bit_matrix
+    # with a row per window, packed a block of windows at a time.
+    cut_off_values = as_storage(cut_off_values, data.dtype)
+    bits = np.empty((data.shape[0], (data.shape[1]+7)//8), dtype=np.uint8)
+    for first in range(0, data.shape[0], block):
+        bits[first:first+block] = bitsets.pack(data[first:first+block] <= cut_off_values)
+
+    progenies = progenies[:data.shape[1]]+['column_{0}'.format(column+1) for column in range(len(progenies), data.shape[1])]
+    return bitsets.Bit_matrix(chrom_names, chroms, positions, bits, progenies, 'below_cut_off')
+
+
+# The matrix a Column_engine worker reads, opened once per process.
+SHARED = None
+
+
+def open_shared(path, shape, dtype):
+
+    global SHARED
+    SHARED = np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+def column_cut_offs(first, last, cut_offs):
+
+    return find_cut_offs(SHARED[:, first:last], cut_offs)
+
+
+def column_runs(first, last, cut_off_values):
+
+    pros, begins, ends = find_runs(SHARED[:, first:last], cut_off_values)
+    return (pros+first, begins, ends)
+
+
+def column_counts(first, last, cut_off_values, low_bound):
+
+    pros, begins, ends = find_runs(SHARED[:, first:last], cut_off_values)
+    keys = expand_runs(begins, ends, SHARED.shape[0], low_bound)
+    return (begins.size, keys.size)+np.unique(keys, return_index=True, return_counts=True)
+
+
+class Serial_engine:
+
+    # Finds cut-offs, runs and interval counts of DATA in this process.
+    def __init__(self, data):
+
+        self.data = data
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *error):
+
+        return False
+
+
+    def cut_offs(self, cut_offs):
+
+        return find_cut_offs(self.data, cut_offs)
+
+
+    def cut_off(self, cut_off):
+
+        return self.cut_offs([cut_off])[0]
+
+
+    def runs(self, cut_off_values):
+
+        return find_runs(self.data, cut_off_values)
+
+
+    def counts(self, cut_off_values, low_bound):
+
+        # Returns (run_num, keys, first, counts) as count_runs gives them, RUN_NUM being the number of runs.
+        pros, begins, ends = find_runs(self.data, cut_off_values)
+        return (begins.size,)+count_runs(begins, ends, self.data.shape[0], low_bound)
+
+
+class Column_engine(Serial_engine):
+
+    # Does the work of Serial_engine with JOBS processes, each on blocks of at most COLUMN_BLOCK progeny columns.
+    # The matrix is the raw file at PATH (written by write_data, in SHARED_DIRECTORY) that every process maps,
+    # so it is not copied to the workers; self.data is the mapped matrix. The file is removed when the engine is closed.
+    def __init__(self, path, shape, dtype, jobs, column_block=256):
+
+        self.path = path
+        self.data = np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+        win_num, pro_num = shape
+        block = max(1, min(column_block, -(-pro_num//jobs)))
+        self.blocks = [(first, min(first+block, pro_num)) for first in range(0, pro_num, block)]
+        self.pool = multiprocessing.Pool(min(jobs, len(self.blocks)), open_shared, (path, shape, np.dtype(dtype).str))
+
+
+    def __exit__(self, *error):
+
+        self.pool.terminate()
+        self.pool.join()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        return False
+
+
+    def cut_offs(self, cut_offs):
+
+        # Errors are found here, as the workers cannot report them.
+        cut_off_ranks(self.data.shape[0], cut_offs)
+        parts = self.pool.starmap(column_cut_offs, [(first, last, cut_offs) for first, last in self.blocks], chunksize=1)
+        return np.concatenate(parts, axis=1)
+
+
+    def runs(self, cut_off_values):
+
+        cut_off_values = np.asarray(cut_off_values)
+        as_storage(cut_off_values, self.data.dtype)
+        parts = self.pool.starmap(column_runs, [(first, last, cut_off_values[first:last]) for first, last in self.blocks], chunksize=1)
+        return tuple(np.concatenate(part) for part in zip(*parts))
+
+
+    def counts(self, cut_off_values, low_bound):
+
+        cut_off_values = np.asarray(cut_off_values)
+        as_storage(cut_off_values, self.data.dtype)
+        parts = self.pool.starmap(column_counts, [(first, last, cut_off_values[first:last], low_bound) for first, last in self.blocks], chunksize=1)
+        return (sum(part[0] for part in parts),)+merge_counts([part[1:] for part in parts])
+
+
+def chunk_runs(data, cut_off_values, chunk_windows):
+
+    # Yields the runs of find_runs, (pros, begins, ends) ordered by progeny and then by begin window, a block of
+    # CHUNK_WINDOWS windows at a time: each run comes with the block holding its end. Runs still open at the end of a
+    # block are carried to the next one, as are runs going over the end of a chromosome, as find_runs does.
+    win_num, pro_num = data.shape
+    cut_off_values = as_storage(cut_off_values, data.dtype)
+    open_begins = np.full(pro_num, -1, dtype=np.int64)
+
+    for first in range(0, win_num, chunk_windows):
+        last = min(first+chunk_windows, win_num)
+
+        # Each progeny is padded with the window before the block, below the cut-off where a run is open,
+        # and a window above the cut-off after it.
+        below = np.zeros((pro_num, last-first+2), dtype=np.int8)
+        below[:, 0] = open_begins >= 0
+        below[:, 1:-1] = (data[first:last] <= cut_off_values).T
+        edges = np.diff(below, axis=1)
+
+        pros, begins = np.nonzero(edges == 1)
+        end_pros, ends = np.nonzero(edges == -1)
+        begins += first
+        ends += first-1
+
+        carried = np.flatnonzero(open_begins >= 0)
+        pros = np.concatenate((carried, pros))
+        begins = np.concatenate((open_begins[carried], begins))
+        order = np.lexsort((begins, pros))
+        pros, begins = pros[order], begins[order]
+
+        # Runs reaching the last window of the block stay open, unless it is the last window.
+        open_begins[:] = -1
+        if last < win_num:
+            still_open = np.flatnonzero(below[:, -2])
+            closed = ends < last-1
+            ends = ends[closed]
+            kept = np.ones(pros.size, dtype=bool)
+            last_begins = np.searchsorted(pros, still_open, side='right')-1
+            kept[last_begins] = False
+            open_begins[still_open] = begins[last_begins]
+            pros, begins = pros[kept], begins[kept]
+
+        yield (pros.astype(np.int64), begins.astype(np.int64), ends.astype(np.int64))
+
+
+class Chunk_engine(Serial_engine):
+
+    # Does the work of Serial_engine on the matrix written by write_data at PATH, mapped from the disk and read
+    # CHUNK_WINDOWS windows at a time, so memory stays near CHUNK_WINDOWS x progenies values whatever the number of
+    # windows. The file is removed when the engine is closed.
+    def __init__(self, path, shape, dtype, chunk_windows=4096):
+
+        self.path = path
+        self.chunk_windows = max(1, chunk_windows)
+        if shape[0] and shape[1]:
+            self.data = np.memmap(path, dtype=dtype, mode='r', shape=shape)
+        else:
+            self.data = np.empty(shape, dtype=dtype)
+
+
+    def __exit__(self, *error):
+
+        self.data = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        return False
+
+
+    def cut_offs(self, cut_offs):
+
+        # An exact cut-off needs every value of the progeny, but only the smallest ones up to the largest rank.
+        # The windows are read once, CHUNK_WINDOWS at a time, keeping that many of the smallest values of every
+        # progeny so far, so all CUT_OFFS come from one pass over the file.
+        win_num, pro_num = self.data.shape
+        keep = max(cut_off_ranks(win_num, cut_offs))
+        smallest = np.empty((0, pro_num), dtype=self.data.dtype)
+        for first in range(0, win_num, self.chunk_windows):
+            smallest = np.concatenate((smallest, self.data[first:first+self.chunk_windows]))
+            if smallest.shape[0] > keep:
+                smallest = np.partition(smallest, keep-1, axis=0)[:keep]
+
+        return find_cut_offs(smallest, cut_offs, win_num)
+
+
+    def runs(self, cut_off_values):
+
+        parts = list(chunk_runs(self.data, cut_off_values, self.chunk_windows))
+        if not parts:
+            return (np.empty(0, dtype=np.int64),)*3
+        pros, begins, ends = [np.concatenate(part) for part in zip(*parts)]
+        order = np.lexsort((begins, pros))
+        return (pros[order], begins[order], ends[order])
+
+
+    def counts(self, cut_off_values, low_bound):
+
+        # The intervals of each block of runs are counted as they come. first is pro*WIN_NUM^2+start of the first
+        # occurrence of an interval instead of its place in count_runs, which orders the intervals the same way.
+        win_num = self.data.shape[0]
+        run_num = 0
+        parts = []
+        for pros, begins, ends in chunk_runs(self.data, cut_off_values, self.chunk_windows):
+            run_num += begins.size
+            keys = expand_runs(begins, ends, win_num, low_bound)
+            order = np.repeat(pros, interval_nums(begins, ends, win_num, low_bound))*win_num*win_num+keys//win_num
+            keys, index, counts = np.unique(keys, return_index=True, return_counts=True)
+            parts.append((0, keys, order[index], counts))
+
+        if not parts:
+            return (0,)+count_runs(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), win_num, low_bound)
+        return (run_num,)+merge_counts(parts)
+
+
+def map_engine(path, shape, dtype, jobs=1):
+
+    # A Column_engine with JOBS processes on the matrix written by write_data at PATH, or a Serial_engine
+    # for one job or a single progeny. The file is removed once the engine no longer needs it.
+    if jobs > 1 and shape[0] and shape[1] > 1:
+        return Column_engine(path, shape, dtype, jobs)
+    data = np.fromfile(path, dtype=dtype).reshape(shape)
+    os.remove(path)
+    return Serial_engine(data)
+
+
+def open_engine(data, jobs=1):
+
+    # map_engine for a matrix already in memory, which is written out for the processes while the caller
+    # still holds it; read_engine parses the data files straight into the shared file instead.
+    if jobs > 1 and data.shape[0] and data.shape[1] > 1:
+        file = tempfile.NamedTemporaryFile(prefix='cnv_data_', suffix='.bin', dir=SHARED_DIRECTORY, delete=False)
+        with file:
+            np.ascontiguousarray(data).tofile(file)
+        return Column_engine(file.name, data.shape, data.dtype, jobs)
+    return Serial_engine(data)
+
+
+def read_engine(file_paths, jobs=1, columns=None, region=None, stats=metrics.NULL, storage='float32', prefetch=bin_reader.PREFETCH_FILES, sketch=None):
+
+    # read_data, then open_engine on the matrix. With several jobs the data files are parsed straight into the file
+    # that the processes map, so the matrix is never held twice.
+    # Returns (engine, chroms, positions, chrom_names); engine.data is the matrix.
+    if jobs <= 1:
+        data, chroms, positions, chrom_names = read_data(file_paths, jobs, columns, region, stats, storage, prefetch, sketch)
+        return (Serial_engine(data), chroms, positions, chrom_names)
+
+    path, shape, chroms, positions, chrom_names = write_data(file_paths, SHARED_DIRECTORY, region, stats, storage, prefetch, sketch, columns, jobs)
+    return (map_engine(path, shape, STORAGE[storage], jobs), chroms, positions, chrom_names)
+
+
+def find_deletes(data, chroms, positions, chrom_names, cut_off_values, low_bound, interval, jobs=1):
+
+    win_num = data.shape[0]
+
+    with open_engine(data, jobs) as engine:
+        run_num, keys, first, counts = engine.counts(cut_off_values, low_bound)
+
+    return combine_deletes(keys, first, counts, win_num, chroms, positions, chrom_names, interval)
+
+
+def read_progenies(file_paths):
+
+    # The progeny names from the header of the data files, which must all hold the same progenies.
+    names = None
+    for path in file_paths:
+        file = bin_reader.open_bin_file(path)
+        header = file.readline().split()[1:]
+        file.close()
+
+        if names is None:
+            names = header
+        elif header != names:
+            sys.stderr.write('Error in "{0}": The progenies differ from "{1}".\n'.format(path, file_paths[0]))
+            sys.exit(1)
+
+    return names
+
+
+def window_digest(chroms, positions, chrom_names):
+
+    digest = hashlib.sha1('\t'.join(chrom_names).encode())
+    digest.update(np.ascontiguousarray(chroms, dtype=np.uint16).tobytes())
+    digest.update(np.ascontiguousarray(positions, dtype=np.int32).tobytes())
+    return digest.hexdigest()
+
+
+def read_state(path, cut_off):
+
+    # state structure:
+    # progenies: progeny names -> cut_off_values: cut-off value of each progeny
+    # pros, begins, ends: every maximal run below the cut-off, pros indexing progenies
+    # windows: digest of the windows the runs refer to
+    # A state made with another CUT_OFF is not used.
+    if not os.path.isfile(path):
+        return None
+
+    with np.load(path, allow_pickle=False) as saved:
+        if float(saved['cut_off']) != cut_off:
+            return None
+        return {'progenies': saved['progenies'].tolist(), 'windows': str(saved['windows']), 'cut_off_values': saved['cut_off_values'],
+                'pros': saved['pros'], 'begins': saved['begins'], 'ends': saved['ends']}
+
+
+def write_state(path, cut_off, state):
+
+    with open(path+'.tmp', 'wb') as file:
+        np.savez(file, cut_off=np.float64(cut_off), progenies=np.array(state['progenies'], dtype=str), windows=np.array(state['windows']),
+                 cut_off_values=state['cut_off_values'], pros=state['pros'], begins=state['begins'], ends=state['ends'])
+    os.replace(path+'.tmp', path)
+
+
+def update_state(file_paths, state_path, cut_off, jobs=1, stats=metrics.NULL, storage='float32', prefetch=bin_reader.PREFETCH_FILES):
+
+    # Only the progenies that are not in the state yet are read and searched.
+    # Progenies that left the data files are dropped from the state.
+    names = read_progenies(file_paths)
+    state = read_state(state_path, cut_off)
+    known = set(state['progenies']) if state else set()
+    columns = [column for column, name in enumerate(names) if name not in known]
+
+    engine, chroms, positions, chrom_names = read_engine(file_paths, jobs, columns, None, stats, storage, prefetch)
+    windows = window_digest(chroms, positions, chrom_names)
+
+    # The runs of the state are only valid for the same windows.
+    if state and state['windows'] != windows:
+        with engine:
+            pass
+        state = None
+        columns = list(range(len(names)))
+        engine, chroms, positions, chrom_names = read_engine(file_paths, jobs, None, None, stats, storage, prefetch)
+
+    # Cut-off values are kept as numbers whatever the storage, so the state serves every --storage.
+    cut_off_values = np.zeros(len(names), dtype=np.float64)
+    runs = []
+    with engine:
+        if columns:
+            cut_off_values[columns] = engine.cut_off(cut_off)
+            pros, begins, ends = engine.runs(cut_off_values[columns])
+            runs.append((np.array(columns, dtype=np.int64)[pros], begins, ends))
+    del engine
+
+    if state:
+        column_of = {name: column for column, name in enumerate(names)}
+        old_columns = np.array([column_of.get(name, -1) for name in state['progenies']], dtype=np.int64)
+        kept = old_columns >= 0
+        cut_off_values[old_columns[kept]] = state['cut_off_values'][kept]
+        pros = old_columns[state['pros']]
+        runs.append((pros[pros >= 0], state['begins'][pros >= 0], state['ends'][pros >= 0]))
+
+    if runs:
+        pros, begins, ends = [np.concatenate(part).astype(np.int64) for part in zip(*runs)]
+    else:
+        pros = begins = ends = np.empty(0, dtype=np.int64)
+
+    # Runs are kept in the order a full search of the data files makes them.
+    order = np.lexsort((begins, pros))
+    state = {'progenies': names, 'windows': windows, 'cut_off_values': cut_off_values,
+             'pros': pros[order], 'begins': begins[order], 'ends': ends[order]}
+    write_state(state_path, cut_off, state)
+
+    return (state, chroms, positions, chrom_names)
+
+
+def state_cut_offs(file_paths, state_path, cut_off):
+
+    # The cut-off values the state keeps for the progenies of the data files.
+    names = read_progenies(file_paths)
+    state = read_state(state_path, cut_off)
+
+    if state is None or not set(names) <= set(state['progenies']):
+        sys.stderr.write('Error in "{0}": No cut-off values for these progenies and cut_off, run without --region first.\n'.format(state_path))
+        sys.exit(1)
+
+    row = {name: n for n, name in enumerate(state['progenies'])}
+    return state['cut_off_values'][[row[name] for name in names]]
+
+
 def write_in_file(data):
     
     file = open('deletion_windows.txt', 'w')
@@ -165,12 +897,70 @@ def write_in_file(data):
         file.write('{0:11}  {1:8} {2:8} {3:8}\n'.format(end[0], data[end][0][1], end[1]+300, data[end][1]))
                               
     file.close()
+
+
+def write_in_table(data, file_path='deletion_windows.npz'):
+
+    ends = sorted(data.keys())
+    columnar.write_table(file_path, 'deletion_windows', [end[0] for end in ends], [data[end][0][1] for end in ends],
+                         [end[1]+300 for end in ends], [data[end][1] for end in ends])
+
     
 # Main flow
-args = parse_args()
-data, info = read_data(args.data_file)
-cut_off_values = find_cut_off(data, args.cut_off)
+if __name__ == '__main__':
+    args = parse_args()
+    stats = metrics.from_args(args)
+
+    if args.state and not args.region:
+        with stats.stage('update_state'):
+            state, chroms, positions, chrom_names = update_state(args.data_file, args.state, args.cut_off, args.jobs, stats, args.storage, args.prefetch)
+        stats.count('progenies', len(state['progenies']))
+        stats.count('runs_found', state['begins'].size)
 
-deletes = find_deletes(data, info, cut_off_values, args.low_bound, args.interval)
+        with stats.stage('count_runs'):
+            keys, first, counts = count_runs(state['begins'], state['ends'], chroms.size, args.low_bound)
+    else:
+        # With --out_of_core the matrix is written to a file as it is read, and every step reads blocks of it.
+        # With -j the matrix is parsed straight into shared memory, and every step works on blocks of progeny columns
+        # in the worker processes.
+        with stats.stage('read_data'):
+            sketch = None if args.sketch is None else quantile_sketch.Lower_tail_sketch(args.sketch)
+            if args.out_of_core is None:
+                engine, chroms, positions, chrom_names = read_engine(args.data_file, args.jobs, None, bin_reader.bin_region(args.region), stats, args.storage, args.prefetch, sketch)
+            else:
+                data_path, shape, chroms, positions, chrom_names = write_data(args.data_file, args.out_of_core, bin_reader.bin_region(args.region), stats, args.storage, args.prefetch, sketch)
+                engine = Chunk_engine(data_path, shape, STORAGE[args.storage], args.chunk_windows)
+            data = engine.data
+        stats.count('progenies', data.shape[1])
+
+        with engine:
+            with stats.stage('find_cut_off'):
+                if args.state:
+                    cut_off_values = state_cut_offs(args.data_file, args.state, args.cut_off)
+                elif sketch is not None:
+                    cut_off_values = sketch_cut_off(sketch, chroms.size, args.cut_off)
+                else:
+                    cut_off_values = engine.cut_off(args.cut_off)
+
+            with stats.stage('count_runs'):
+                run_num, keys, first, counts = engine.counts(cut_off_values, args.low_bound)
+            stats.count('runs_found', run_num)
+
+            if args.bits:
+                with stats.stage('write_bits'):
+                    below_cut_off_bits(data, chroms, positions, chrom_names, cut_off_values, read_progenies(args.data_file)).save(args.bits)
+        del data, engine
 
-write_in_file(deletes)
+    stats.count('windows_kept', chroms.size)
+
+    with stats.stage('combine_deletes'):
+        deletes = combine_deletes(keys, first, counts, chroms.size, chroms, positions, chrom_names, args.interval)
+    stats.count('intervals_counted', keys.size)
+    stats.count('deletion_windows', len(deletes))
+
+    with stats.stage('write_in_file'):
+        if args.columnar:
+            write_in_table(deletes)
+        else:
+            write_in_file(deletes)
+    stats.write()
@@ -0,0 +1,105 @@
+#############################################
+#
+# gff_cache.py
+#
+# Read the genes of a GFF file, and keep them
+# in a binary cache next to the GFF so later
+# runs do not parse the GFF again.
+#
+# Written using Python 3.6.5
+#
+#############################################
+
+import io, os, sys
+
+import numpy as np
+
+from intervals import in_region
+
+
+def cache_path(file_path):
+
+    return file_path+'.genes.npz'
+
+
+def parse_gff(file_path):
+
+    # genes structure:
+    # (chromosomes, gene_begin locations, gene_end locations, attributes), one entry per gene
+    chroms = []
+    begins = []
+    ends = []
+    attributes = []
+
+    file = io.open(file_path)
+
+    for line in file:
+
+        if line[0] == '#':
+            continue
+
+        if not line.startswith('Pf'):
+            sys.stderr.write('Error in "{0}": Unexpected data format.\n'.format(file_path))
+            sys.exit(1)
+
+        # A gene line needs all nine columns, and the gene ID taken from its attributes.
+        split_line = line.split('\t')
+        if len(split_line) < 9 or (split_line[2] == 'gene' and not split_line[8].strip()):
+            sys.stderr.write('Error in "{0}": Unexpected data format.\n'.format(file_path))
+            sys.exit(1)
+
+        if split_line[2] == 'gene':
+            loc_beg = split_line[3]
+            loc_end = split_line[4]
+
+            if not loc_beg or not loc_end:
+                continue
+
+            chroms.append(split_line[0])
+            begins.append(int(loc_beg))
+            ends.append(int(loc_end))
+            attributes.append(split_line[8].strip())
+
+    file.close()
+
+    return (chroms, begins, ends, attributes)
+
+
+def select_genes(chroms, begins, ends, attributes, region):
+
+    # Keeps the genes overlapping REGION (chromosome, begin location, end location); a location of None leaves that side open.
+    kept = [n for n in range(len(chroms)) if in_region(region, chroms[n], begins[n], ends[n])]
+
+    return ([chroms[n] for n in kept], [begins[n] for n in kept], [ends[n] for n in kept], [attributes[n] for n in kept])
+
+
+def read_genes(file_path, cache=True):
+
+    # The cache is only used while the GFF keeps the size and modification time it had when the cache was written.
+    stat = os.stat(file_path)
+    stamp = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    path = cache_path(file_path)
+
+    if cache and os.path.isfile(path):
+        try:
+            with np.load(path, allow_pickle=False) as saved:
+                # A cache written before empty attributes were reported is parsed again.
+                if np.array_equal(saved['stamp'], stamp) and all(saved['attributes']):
+                    return (saved['chroms'].tolist(), saved['begins'].tolist(), saved['ends'].tolist(), saved['attributes'].tolist())
+        except (OSError, ValueError, KeyError):
+            pass
+
+    chroms, begins, ends, attributes = parse_gff(file_path)
+
+    if cache:
+
+        # Write to a temporary file first, so a run that stops halfway never leaves a broken cache.
+        try:
+            with open(path+'.tmp', 'wb') as file:
+                np.savez(file, stamp=stamp, chroms=np.array(chroms, dtype=str), begins=np.array(begins, dtype=np.int64),
+                         ends=np.array(ends, dtype=np.int64), attributes=np.array(attributes, dtype=str))
+            os.replace(path+'.tmp', path)
+        except OSError:
+            pass
+
+    return (chroms, begins, ends, attributes)
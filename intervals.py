@@ -0,0 +1,111 @@
+#############################################
+#
+# intervals.py
+#
+# Index intervals by chromosome and find all
+# the intervals overlapping a batch of queries.
+#
+# Written using Python 3.6.5
+#
+#############################################
+
+import numpy as np
+
+
+class Interval_index:
+
+    def __init__(self, chroms, begins, ends):
+
+        # index structure:
+        # index key: chrom -> (item numbers, begin locations, end locations, largest end location so far),
+        # all sorted by begin location, then end location, then item number.
+        self.index = {}
+
+        chroms = np.asarray(chroms)
+        begins = np.asarray(begins, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        if not chroms.size:
+            return
+        names, codes = np.unique(chroms, return_inverse=True)
+        for code, chrom in enumerate(names.tolist()):
+            items = np.flatnonzero(codes == code)
+            items = items[np.lexsort((items, ends[items], begins[items]))]
+            self.index[chrom] = (items, begins[items], ends[items], np.maximum.accumulate(ends[items]))
+
+
+    def search(self, chrom, begins, ends):
+
+        # Returns (query numbers, item numbers) of every item overlapping a query [begin, end],
+        # grouped by query in the given order and sorted by item location within a query.
+        begins = np.asarray(begins, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        if chrom not in self.index or not begins.size:
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        items, item_begins, item_ends, reach = self.index[chrom]
+
+        # Items before LOW all end before the query begins, and items from HIGH on all begin after the query ends.
+        low = np.searchsorted(reach, begins, 'left')
+        high = np.searchsorted(item_begins, ends, 'right')
+        nums = np.maximum(high-low, 0)
+
+        queries = np.repeat(np.arange(begins.size), nums)
+        offsets = np.repeat(np.cumsum(nums)-nums, nums)
+        candidates = np.repeat(low, nums)+np.arange(queries.size)-offsets
+
+        hits = item_ends[candidates] >= begins[queries]
+        return (queries[hits], items[candidates[hits]])
+
+
+
+    def count(self, chrom, begins, ends):
+
+        # Returns the number of items overlapping each query.
+        queries = self.search(chrom, begins, ends)[0]
+        return np.bincount(queries, minlength=len(begins))
+
+
+    def first(self, chrom, begins, ends):
+
+        # Returns the smallest item number overlapping each query, or -1 if none does.
+        queries, items = self.search(chrom, begins, ends)
+        first = np.full(len(begins), np.iinfo(np.int64).max)
+        np.minimum.at(first, queries, items)
+        first[first == np.iinfo(np.int64).max] = -1
+        return first
+
+
+def parse_region(text):
+
+    # 'Pf3D7_05_v3:100000-200000' -> ('Pf3D7_05_v3', 100000, 200000)
+    # 'Pf3D7_05_v3' -> ('Pf3D7_05_v3', None, None), the whole chromosome
+    chrom, sep, span = text.partition(':')
+    if not sep:
+        return (chrom, None, None)
+
+    begin, sep, end = span.replace(',', '').partition('-')
+    begin = int(begin) if begin else None
+    end = int(end) if end else None
+    if begin is not None and end is not None and end < begin:
+        raise ValueError('Region "{0}" ends before it begins.'.format(text))
+
+    return (chrom, begin, end)
+
+
+def in_region(region, chrom, begin, end):
+
+    # Whether [BEGIN, END] on CHROM overlaps REGION. No region holds everything.
+    if region is None:
+        return True
+    return chrom == region[0] and (region[1] is None or end >= region[1]) and (region[2] is None or begin <= region[2])
+
+
+def widen_region(region, margin):
+
+    # REGION with MARGIN more on each side. Items overlapping REGION and at most MARGIN long lie within it,
+    # so whatever overlaps one of them, also outside REGION, overlaps the wider region.
+    if region is None:
+        return None
+    chrom, begin, end = region
+    return (chrom, None if begin is None else begin-margin, None if end is None else end+margin)
@@ -0,0 +1,222 @@
+##############################################################
+#
+# make_synthetic_cohort.py
+#
+# Write a synthetic cohort: bin files laid out like
+# data_format_example.txt, a gff file with the genes of the
+# same chromosomes and a core genome file like core.txt. Known
+# deletions are planted in the bin files and listed in
+# planted_deletions.txt, so the methods can be checked and
+# timed at any size.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import argparse, gzip, os
+
+import numpy as np
+
+import bin_reader
+
+# Values are written with 5 decimals, and at most MAX_CODE/10^5.
+MAX_CODE = 999999
+
+# Rows of at most CHUNK_SIZE values are made at once.
+CHUNK_SIZE = 1 << 22
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Write a synthetic cohort (bin files, gff file and core genome file) with planted deletions.')
+    parser.add_argument('output_dir', help='Directory the cohort is written to. It is made if missing')
+    parser.add_argument('--chromosomes', '-n', type=int, default=14, help='Number of chromosomes. Default = 14')
+    parser.add_argument('--bins', '-b', type=int, default=2000, help='Number of windows of each chromosome. Default = 2000')
+    parser.add_argument('--progenies', '-p', type=int, default=51, help='Number of progenies. Default = 51')
+    parser.add_argument('--files', '-f', type=int, default=1, help='Number of bin files the chromosomes are split over. Default = 1')
+    parser.add_argument('--api_bins', type=int, default=20, help='Number of Pf3D7_API_v3 windows, which the methods leave out. Default = 20')
+    parser.add_argument('--deletions', '-d', type=int, default=20, help='Number of planted deletions. Default = 20')
+    parser.add_argument('--deletion_length', type=int, nargs=2, default=[3, 30], help='Smallest and largest number of windows of a deletion. Default = 3 30')
+    parser.add_argument('--deletion_progenies', type=int, nargs=2, default=[10, 40], help='Smallest and largest number of progenies sharing a deletion. Default = 10 40')
+    parser.add_argument('--zero_rate', type=float, default=0.001, help='Share of zeros outside the deletions. Default = 0.001')
+    parser.add_argument('--deletion_zero_rate', type=float, default=0.3, help='Share of zeros inside the deletions, the other values being below 0.01. Default = 0.3')
+    parser.add_argument('--compress', choices=['none', 'gzip', 'bgzf'], default='none', help='Compression of the bin files. Default = none')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random numbers. Default = 0')
+
+    args = parser.parse_args()
+
+    if min(args.chromosomes, args.bins, args.progenies, args.files) < 1:
+        parser.error('--chromosomes, --bins, --progenies and --files must be at least 1.')
+    if args.files > args.chromosomes:
+        parser.error('--files cannot be larger than --chromosomes.')
+    if not 1 <= args.deletion_length[0] <= args.deletion_length[1]:
+        parser.error('--deletion_length takes two integers with 1 <= SMALLEST <= LARGEST.')
+    if not 1 <= args.deletion_progenies[0] <= args.deletion_progenies[1]:
+        parser.error('--deletion_progenies takes two integers with 1 <= SMALLEST <= LARGEST.')
+
+    return args
+
+
+def chrom_name(num):
+
+    return 'Pf3D7_{0:02d}_v3'.format(num)
+
+
+def value_table():
+
+    # code -> the value code/10^5 as written in the bin files, trailing zeros removed ('0' for zero)
+    return np.array(['{0:.5f}'.format(code/100000).rstrip('0').rstrip('.') for code in range(MAX_CODE+1)], dtype=object)
+
+
+def plant_deletions(rng, chrom_num, bin_num, pro_num, deletion_num, length, progenies):
+
+    # deletions structure:
+    # (chromosome number, first bin, last bin, progeny numbers), sorted by chromosome and first bin
+    deletions = []
+    for n in range(deletion_num):
+        chrom = rng.randint(chrom_num)
+        size = min(rng.randint(length[0], length[1]+1), bin_num)
+        first = rng.randint(bin_num-size+1)
+        pros = np.sort(rng.choice(pro_num, min(rng.randint(progenies[0], progenies[1]+1), pro_num), replace=False))
+        deletions.append((chrom, first, first+size-1, pros))
+
+    return sorted(deletions, key=lambda deletion: (deletion[0], deletion[1]))
+
+
+def make_values(rng, row_num, pro_num, zero_rate):
+
+    # Codes of the values of ROW_NUM windows, around 1 as coverage ratios are.
+    codes = np.minimum(np.rint(rng.lognormal(0, 0.4, (row_num, pro_num))*100000), MAX_CODE).astype(np.int32)
+    codes[rng.random_sample((row_num, pro_num)) < zero_rate] = 0
+
+    return codes
+
+
+def open_output(path, compress):
+
+    if compress == 'gzip':
+        return gzip.open(path, 'wb')
+    if compress == 'bgzf':
+        return bin_reader.Bgzf_writer(path)
+    return open(path, 'wb')
+
+
+def write_bin_files(output_dir, args, deletions, rng):
+
+    table = value_table()
+    suffix = '' if args.compress == 'none' else '.gz'
+    if args.files == 1:
+        paths = [os.path.join(output_dir, 'read.data.txt'+suffix)]
+    else:
+        paths = [os.path.join(output_dir, 'read.data.{0}.txt{1}'.format(n+1, suffix)) for n in range(args.files)]
+
+    # The chromosomes are split over the files in order, the API windows going to the last file.
+    chroms = [(chrom_name(num+1), args.bins) for num in range(args.chromosomes)]
+    files = np.linspace(0, args.files, len(chroms), endpoint=False).astype(int).tolist()
+    if args.api_bins > 0:
+        chroms.append(('Pf3D7_API_v3', args.api_bins))
+        files.append(args.files-1)
+    rows = max(1, CHUNK_SIZE//args.progenies)
+    header = ('Bin\t'+'\t'.join('progeny_{0}'.format(pro+1) for pro in range(args.progenies))+'\n').encode()
+
+    file = None
+    for chrom_num, (chrom, bin_num) in enumerate(chroms):
+        if file is None or files[chrom_num] != files[chrom_num-1]:
+            if file is not None:
+                file.close()
+            file = open_output(paths[files[chrom_num]], args.compress)
+            file.write(header)
+
+        for first in range(0, bin_num, rows):
+            last = min(first+rows, bin_num)-1
+            codes = make_values(rng, last-first+1, args.progenies, args.zero_rate)
+
+            for deletion_chrom, deletion_first, deletion_last, pros in deletions:
+                if deletion_chrom != chrom_num or deletion_last < first or deletion_first > last:
+                    continue
+                begin = max(deletion_first, first)-first
+                end = min(deletion_last, last)-first+1
+                shape = (end-begin, len(pros))
+                low = rng.randint(1, 1000, shape)
+                codes[begin:end, pros] = np.where(rng.random_sample(shape) < args.deletion_zero_rate, 0, low)
+
+            values = table[codes]
+            file.write(''.join('{0}_{1}\t{2}\n'.format(chrom, first+row, '\t'.join(values[row])) for row in range(len(values))).encode())
+
+    file.close()
+
+    return paths
+
+
+def write_gff(file_path, args, rng):
+
+    file = open(file_path, 'w')
+    file.write('##gff-version 3\n')
+    for num in range(args.chromosomes):
+        file.write('##sequence-region {0} 1 {1}\n'.format(chrom_name(num+1), args.bins*300))
+
+    for num in range(args.chromosomes):
+        chrom = chrom_name(num+1)
+        loc_end = 0
+        gene = 0
+
+        while True:
+            loc_beg = loc_end+rng.randint(200, 3000)
+            loc_end = loc_beg+rng.randint(300, 8000)
+            if loc_end > args.bins*300:
+                break
+            gene += 1
+            gene_id = 'PF3D7_{0:02d}{1:05d}'.format(num+1, gene*100)
+            strand = '+' if rng.random_sample() < 0.5 else '-'
+
+            file.write('{0}\tVEuPathDB\tgene\t{1}\t{2}\t.\t{3}\t.\tID={4};description=synthetic+gene\n'.format(chrom, loc_beg, loc_end, strand, gene_id))
+            file.write('{0}\tVEuPathDB\tmRNA\t{1}\t{2}\t.\t{3}\t.\tID={4}.1;Parent={4}\n'.format(chrom, loc_beg, loc_end, strand, gene_id))
+            file.write('{0}\tVEuPathDB\texon\t{1}\t{2}\t.\t{3}\t.\tID=exon_{4}.1-E1;Parent={4}.1\n'.format(chrom, loc_beg, loc_end, strand, gene_id))
+
+    file.close()
+
+
+def write_cores(file_path, args):
+
+    # Two core regions on each chromosome, leaving out the subtelomeres and a small gap in the middle.
+    file = open(file_path, 'w')
+
+    for num in range(args.chromosomes):
+        size = args.bins*300
+        for loc_beg, loc_end in [(size*8//100+1, size*49//100), (size*51//100+1, size*92//100)]:
+            file.write('{0} {1} {2} Core {3}\n'.format(chrom_name(num+1), loc_beg, loc_end, loc_end-loc_beg+1))
+
+    file.close()
+
+
+def write_planted(file_path, deletions):
+
+    file = open(file_path, 'w')
+    file.write('{0:11}  {1:8} {2:8} {3}\n'.format('Chromosome', 'begin', 'end', 'progenies'))
+
+    for chrom, first, last, pros in deletions:
+        file.write('{0:11}  {1:8} {2:8} {3}\n'.format(chrom_name(chrom+1), first*300, last*300+300, len(pros)))
+
+    file.close()
+
+
+def make_cohort(output_dir, args):
+
+    # Returns the paths of the bin files.
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    rng = np.random.RandomState(args.seed)
+
+    deletions = plant_deletions(rng, args.chromosomes, args.bins, args.progenies, args.deletions, args.deletion_length, args.deletion_progenies)
+    paths = write_bin_files(output_dir, args, deletions, rng)
+    write_gff(os.path.join(output_dir, 'genome.gff'), args, rng)
+    write_cores(os.path.join(output_dir, 'core.txt'), args)
+    write_planted(os.path.join(output_dir, 'planted_deletions.txt'), deletions)
+
+    return paths
+
+
+# Main flow
+if __name__ == '__main__':
+    args = parse_args()
+    make_cohort(args.output_dir, args)
@@ -0,0 +1,189 @@
+##############################################################
+#
+# metrics.py
+#
+# Record the wall time, CPU time and peak memory of each stage
+# of a script, with counters of what it read and found, and
+# write them as JSON or Prometheus text (--metrics FILE). One
+# stage can also be run under cProfile (--profile STAGE).
+# Without these options the scripts get NULL, which records
+# nothing.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import cProfile, json, os, resource, sys, time
+from collections import OrderedDict
+
+def add_arguments(parser):
+
+    parser.add_argument('--metrics', help='Write the time and memory of every stage, and counters of what was read and found, to METRICS')
+    parser.add_argument('--metrics_format', choices=['json', 'prometheus'], default='json', help='Format of the --metrics file. Default = json')
+    parser.add_argument('--profile', metavar='STAGE', help='Run STAGE under cProfile and write the statistics to STAGE.prof (read them with python3 -m pstats STAGE.prof)')
+
+
+def from_args(args):
+
+    if not args.metrics and not args.profile:
+        return NULL
+    return Metrics(os.path.splitext(os.path.basename(sys.argv[0]))[0], args.metrics, args.metrics_format, args.profile)
+
+
+def max_rss(who=resource.RUSAGE_SELF):
+
+    # Peak resident memory in bytes; Linux reports it in kilobytes, macOS in bytes.
+    rss = resource.getrusage(who).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss*1024
+
+
+class Stage:
+
+    def __init__(self, metrics, name):
+
+        self.metrics = metrics
+        self.name = name
+
+
+    def __enter__(self):
+
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        if self.name == self.metrics.profile_stage:
+            self.metrics.profiler.enable()
+        return self
+
+
+    def __exit__(self, *error):
+
+        if self.name == self.metrics.profile_stage:
+            self.metrics.profiler.disable()
+        cpu = time.process_time()-self.cpu
+        wall = time.perf_counter()-self.wall
+
+        # A stage entered several times (for example once per file) adds up.
+        stage = self.metrics.stages.setdefault(self.name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+        stage['calls'] += 1
+        stage['wall'] += wall
+        stage['cpu'] += cpu
+        stage['max_rss'] = max_rss()
+        stage['max_rss_children'] = max_rss(resource.RUSAGE_CHILDREN)
+
+        return False
+
+
+class Metrics:
+
+    def __init__(self, script, path=None, file_format='json', profile_stage=None):
+
+        # stages structure:
+        # stage name -> {calls, wall, cpu, max_rss, max_rss_children}, in the order the stages first ran
+        # max_rss is the peak memory of the process at the end of the stage, in bytes
+        self.script = script
+        self.path = path
+        self.file_format = file_format
+        self.profile_stage = profile_stage
+        self.profiler = cProfile.Profile() if profile_stage else None
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+
+    def stage(self, name):
+
+        return Stage(self, name)
+
+
+    def count(self, name, value=1):
+
+        self.counters[name] = self.counters.get(name, 0)+int(value)
+
+
+    def counted(self, name, items):
+
+        # Yields ITEMS, counting them under NAME.
+        for item in items:
+            self.count(name)
+            yield item
+
+
+    def report(self):
+
+        return OrderedDict([('script', self.script), ('wall', time.perf_counter()-self.wall), ('cpu', time.process_time()-self.cpu),
+                            ('max_rss', max_rss()), ('max_rss_children', max_rss(resource.RUSAGE_CHILDREN)),
+                            ('stages', [OrderedDict([('stage', name)]+list(stage.items())) for name, stage in self.stages.items()]),
+                            ('counters', self.counters)])
+
+
+    def prometheus(self, report):
+
+        lines = []
+        for key, kind, text in [('wall', 'seconds', 'Wall time'), ('cpu', 'seconds', 'CPU time'), ('max_rss', 'bytes', 'Peak resident memory')]:
+            lines.append('# HELP cnv_stage_{0}_{1} {2} of each stage.'.format(key, kind, text))
+            lines.append('# TYPE cnv_stage_{0}_{1} gauge'.format(key, kind))
+            for stage in report['stages']:
+                lines.append('cnv_stage_{0}_{1}{{script="{2}",stage="{3}"}} {4}'.format(key, kind, self.script, stage['stage'], stage[key]))
+
+        for name, value in report['counters'].items():
+            lines.append('# TYPE cnv_{0}_total counter'.format(name))
+            lines.append('cnv_{0}_total{{script="{1}"}} {2}'.format(name, self.script, value))
+
+        return '\n'.join(lines)+'\n'
+
+
+    def write(self):
+
+        if self.profiler is not None:
+            if self.profile_stage in self.stages:
+                self.profiler.dump_stats(self.profile_stage+'.prof')
+            else:
+                sys.stderr.write('Warning: no stage "{0}" to profile, the stages are: {1}.\n'.format(self.profile_stage, ', '.join(self.stages)))
+
+        if self.path:
+            report = self.report()
+            with open(self.path, 'w') as file:
+                if self.file_format == 'prometheus':
+                    file.write(self.prometheus(report))
+                else:
+                    json.dump(report, file, indent=2)
+                    file.write('\n')
+
+
+class Null_stage:
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *error):
+
+        return False
+
+
+class Null_metrics:
+
+    # Stands in for Metrics when nothing is recorded.
+    def stage(self, name):
+
+        return NULL_STAGE
+
+
+    def count(self, name, value=1):
+
+        pass
+
+
+    def counted(self, name, items):
+
+        return items
+
+
+    def write(self):
+
+        pass
+
+
+NULL_STAGE = Null_stage()
+NULL = Null_metrics()
@@ -0,0 +1,98 @@
+##############################################################
+#
+# quantile_sketch.py
+#
+# Estimate low quantiles (the cut-off values of
+# find_deletion_windows.py) of every progeny in one pass over
+# the data, with memory that does not grow with the number of
+# windows. Values are counted in buckets whose bounds grow by a
+# constant factor, so every estimate is within a set relative
+# error of the exact quantile.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import sys
+
+import numpy as np
+
+class Lower_tail_sketch:
+
+    def __init__(self, error=0.01, min_value=1e-5, max_value=1e3):
+
+        # Bucket 0 counts the values of 0 or less, bucket n (1 <= n < size-1) the values in
+        # (min_value*gamma^(n-1), min_value*gamma^n] (values below min_value going to bucket 1),
+        # and the last bucket the values above max_value (NaN included).
+        # counts structure:
+        # progeny -> bucket -> number of values, made when the first values come
+        if not 0 < error < 1:
+            sys.stderr.write('Error: The sketch error must be between 0 and 1, not {0}.\n'.format(error))
+            sys.exit(1)
+        self.error = error
+        self.gamma = (1+error)/(1-error)
+        self.min_value = min_value
+        self.max_value = max_value
+        self.size = int(np.ceil(np.log(max_value/min_value)/np.log(self.gamma)))+2
+        self.counts = None
+
+
+    def empty(self):
+
+        # A sketch with the same settings and no values.
+        return Lower_tail_sketch(self.error, self.min_value, self.max_value)
+
+
+    def bounds(self):
+
+        # Upper bound of every bucket but the last.
+        return np.concatenate(([0.0], self.min_value*self.gamma**np.arange(1, self.size-1)))
+
+
+    def update(self, values):
+
+        # Counts VALUES, a 2-D array windows x progenies.
+        values = np.asarray(values, dtype=np.float64)
+        if self.counts is None:
+            self.counts = np.zeros((values.shape[1], self.size), dtype=np.int64)
+        if not values.size:
+            return
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            buckets = np.ceil(np.log(values/self.min_value)/np.log(self.gamma))
+        buckets = np.clip(np.where(np.isnan(buckets), 1, buckets), 1, self.size-2)
+        buckets[values <= 0] = 0
+        buckets[~(values <= self.max_value)] = self.size-1
+
+        keys = buckets.astype(np.int64)+np.arange(values.shape[1], dtype=np.int64)*self.size
+        self.counts += np.bincount(keys.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+
+
+    def merge(self, other):
+
+        # Adds the counts of OTHER, a sketch with the same settings made over other windows of the same progenies.
+        if other.counts is None:
+            return
+        if self.counts is None:
+            self.counts = other.counts.copy()
+        else:
+            self.counts += other.counts
+
+
+    def quantile(self, rank):
+
+        # Returns (estimates, lower, upper): for every progeny an estimate of its RANK-th smallest value,
+        # within ERROR (relative) of it, and the bounds of the bucket the value is in. A value of 0 or less is
+        # given as 0 exactly.
+        if self.counts is None:
+            return (np.empty(0),)*3
+        found = np.argmax(np.cumsum(self.counts, axis=1) >= rank, axis=1)
+        if (found == self.size-1).any():
+            sys.stderr.write('Error: A cut-off value is above {0}, the largest value the sketch holds.\n'.format(self.max_value))
+            sys.exit(1)
+
+        upper = self.bounds()[found]
+        lower = np.where(found > 1, upper/self.gamma, 0.0)
+        estimates = np.where(found > 0, 2*upper/(self.gamma+1), 0.0)
+
+        return (estimates, lower, upper)
@@ -0,0 +1,89 @@
+##############################################################
+#
+# query_deletions.py
+#
+# Query a bit matrix of deletion calls written by
+# CNV_Match.py --bits (zeros) or find_deletion_windows.py
+# --bits (values below the cut-off): the progenies deleted in
+# all (or any) of some windows, or the windows deleted in at
+# least K progenies of a subset. Output is printed to stdout.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import argparse, os, sys
+
+import bitsets, metrics
+
+def parse_window(text):
+
+    # 'CHROM:POS' -> (chrom, pos), POS being the window location as in data.map
+    chrom, sep, pos = text.rpartition(':')
+    if not sep or not chrom or not pos.isdigit():
+        raise argparse.ArgumentTypeError('Window "{0}" must be written CHROM:POS, for example Pf3D7_05_v3:100200.'.format(text))
+
+    return (chrom, int(pos))
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Query a bit matrix of deletion calls written with --bits.')
+    parser.add_argument('bits_file', help='a bit matrix written by CNV_Match.py --bits or find_deletion_windows.py --bits')
+    parser.add_argument('--windows', '-w', type=parse_window, nargs='+', help='print the progenies deleted in all of WINDOWS, each written CHROM:POS')
+    parser.add_argument('--any', action='store_true', help='with --windows, print the progenies deleted in any of them instead')
+    parser.add_argument('--at_least', '-k', type=int, help='print the windows deleted in at least AT_LEAST progenies, with their number')
+    parser.add_argument('--progenies', '-p', nargs='+', help='with --at_least, only count these progenies')
+    metrics.add_arguments(parser)
+
+    args = parser.parse_args()
+    if (args.windows is None) == (args.at_least is None):
+        parser.error('Give one of --windows and --at_least.')
+    if not os.path.isfile(args.bits_file):
+        parser.error('File "{0}" cannot be found.'.format(args.bits_file))
+
+    return args
+
+
+def progenies_in(matrix, windows, how='and'):
+
+    rows = [matrix.row(chrom, pos) for chrom, pos in windows]
+    missing = ['{0}:{1}'.format(chrom, pos) for (chrom, pos), row in zip(windows, rows) if row < 0]
+    if missing:
+        sys.stderr.write('Error: No window {0}.\n'.format(', '.join(missing)))
+        sys.exit(1)
+
+    return matrix.progenies_in(rows, how)
+
+
+def windows_with(matrix, num, progenies=None):
+
+    # Returns (chromosome, window location, number of deleted progenies) of the windows deleted in at least NUM progenies.
+    counts = matrix.counts(progenies)
+    return [matrix.window(row)+(int(counts[row]),) for row in matrix.windows_with(num, progenies).tolist()]
+
+
+def main(args, stats=metrics.NULL):
+
+    with stats.stage('load'):
+        matrix = bitsets.load(args.bits_file)
+    stats.count('windows', len(matrix.positions))
+    stats.count('progenies', len(matrix.progenies))
+
+    with stats.stage('query'):
+        if args.windows is not None:
+            hits = [name+'\n' for name in progenies_in(matrix, args.windows, 'or' if args.any else 'and')]
+        else:
+            hits = ['{0}\t{1}\t{2}\n'.format(chrom, pos, count) for chrom, pos, count in windows_with(matrix, args.at_least, args.progenies)]
+    stats.count('hits', len(hits))
+
+    with stats.stage('write'):
+        sys.stdout.writelines(hits)
+
+
+# Main flow
+if __name__ == '__main__':
+    args = parse_args()
+    stats = metrics.from_args(args)
+    main(args, stats)
+    stats.write()
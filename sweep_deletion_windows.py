@@ -0,0 +1,127 @@
+##############################################################
+#
+# sweep_deletion_windows.py
+#
+# Run find_deletion_windows.py over a grid of CUT_OFF,
+# LOW_BOUND and INTERVAL values. The data are read once, the
+# cut-offs of all the grid come from one partition, and the runs
+# of each cut-off are searched once and then filtered for every
+# LOW_BOUND and INTERVAL.
+#
+# Written using Python 3.6.5
+#
+###############################################################
+
+import argparse, os
+
+import bin_reader, metrics
+from find_deletion_windows import STORAGE, read_data, find_cut_offs, find_runs, count_runs, combine_deletes
+from intervals import parse_region
+
+def parse_grid(values, kind):
+
+    # Each value is either a number or a range START:STOP:STEP, STOP included.
+    grid = []
+    for value in values:
+        if ':' in value:
+            start, stop, step = [kind(part) for part in value.split(':')]
+            if step <= 0:
+                raise argparse.ArgumentTypeError('Step of "{0}" must be positive.'.format(value))
+            num = int(round((stop-start)/step+1e-9))+1
+            grid.extend(kind(start+step*n) for n in range(num))
+        else:
+            grid.append(kind(value))
+
+    return sorted(set(round(value, 10) if kind is float else value for value in grid))
+
+
+def parse_args():
+    
+    parser = argparse.ArgumentParser(description='Take a data file to find potential deletion windows for every combination of parameters.')
+    parser.add_argument('data_file', help='an input data file', nargs = '+')
+    parser.add_argument('--cut_off', '-c', action='append', help='A CUT_OFF value to try, a number or a range START:STOP:STEP. Repeat the option for more. Default = 0.01')
+    parser.add_argument('--low_bound', '-l', action='append', help='A LOW_BOUND value to try, a number or a range START:STOP:STEP. Repeat the option for more. Default = 3')
+    parser.add_argument('--interval', '-i', action='append', help='An interval to try, written LOW,HIGH. Repeat the option for more. Default = 10,40. Example input: -i 10,40 -i 5,45')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of processes that read the data files. Default = 1')
+    parser.add_argument('--region', '--chrom', type=parse_region, help='Only reads and searches the windows overlapping REGION, written CHROM or CHROM:BEGIN-END. Cut-offs then come from those windows only')
+    parser.add_argument('--prefetch', type=int, default=bin_reader.PREFETCH_FILES, help='With one job, number of data files read at once in background threads while they are parsed in order. 0 reads them in turn. Default = {0}'.format(bin_reader.PREFETCH_FILES))
+    parser.add_argument('--storage', choices=list(STORAGE), default='float32', help='How the values are kept in memory, as in find_deletion_windows.py. Default = float32')
+    parser.add_argument('--output', '-o', default='deletion_windows_sweep.txt', help='Output file. Default = deletion_windows_sweep.txt')
+    metrics.add_arguments(parser)
+    
+    args = parser.parse_args()
+
+    for path in args.data_file:
+        if not os.path.isfile(path):
+            parser.error('File "{0}" cannot be found.'.format(path))
+
+    try:
+        args.cut_off = parse_grid(args.cut_off or ['0.01'], float)
+        args.low_bound = parse_grid(args.low_bound or ['3'], int)
+        args.interval = [tuple(int(part) for part in value.split(',')) for value in args.interval or ['10,40']]
+    except (ValueError, argparse.ArgumentTypeError) as error:
+        parser.error(str(error))
+    if any(len(interval) != 2 for interval in args.interval):
+        parser.error('Each interval takes two integers written LOW,HIGH.')
+
+    return args
+
+
+def sweep(data, chroms, positions, chrom_names, cut_offs, low_bounds, intervals):
+
+    win_num = data.shape[0]
+
+    # results structure:
+    # (cut_off, low_bound, interval) -> deletes as returned by find_deletes
+    results = {}
+    cut_off_values = find_cut_offs(data, cut_offs)
+    low_bounds = sorted(low_bounds)
+
+    for cut_off, values in zip(cut_offs, cut_off_values):
+        pros, begins, ends = find_runs(data, values)
+
+        # The intervals of a larger LOW_BOUND are the ones of the smallest LOW_BOUND that are long enough,
+        # with the same counts and in the same order.
+        keys, first, counts = count_runs(begins, ends, win_num, low_bounds[0])
+        lengths = keys%win_num-keys//win_num+1
+
+        for low_bound in low_bounds:
+            kept = lengths >= low_bound
+            for interval in intervals:
+                results[(cut_off, low_bound, interval)] = combine_deletes(keys[kept], first[kept], counts[kept], win_num, chroms, positions, chrom_names, interval)
+
+    return results
+
+
+def write_in_file(results, file_path):
+    
+    file = open(file_path, 'w')
+    
+    file.write('deletion windows:\n')
+    file.write('{0:8} {1:9} {2:8} {3:8} {4:11}  {5:8} {6:8} {7:8}\n'.format('cut_off', 'low_bound', 'low', 'high', 'Chromosome', 'begin', 'end', 'No(deletions)'))
+    for key in sorted(results.keys()):
+        data = results[key]
+        for end in sorted(data.keys()):
+            file.write('{0:<8g} {1:9} {2:8} {3:8} {4:11}  {5:8} {6:8} {7:8}\n'.format(key[0], key[1], key[2][0], key[2][1], end[0], data[end][0][1], end[1]+300, data[end][1]))
+                              
+    file.close()
+
+
+# Main flow
+if __name__ == '__main__':
+    args = parse_args()
+    stats = metrics.from_args(args)
+
+    with stats.stage('read_data'):
+        data, chroms, positions, chrom_names = read_data(args.data_file, args.jobs, None, bin_reader.bin_region(args.region), stats, args.storage, args.prefetch)
+    stats.count('windows_kept', data.shape[0])
+    stats.count('progenies', data.shape[1])
+
+    with stats.stage('sweep'):
+        results = sweep(data, chroms, positions, chrom_names, args.cut_off, args.low_bound, args.interval)
+    stats.count('parameter_sets', len(results))
+    stats.count('deletion_windows', sum(len(deletes) for deletes in results.values()))
+
+    with stats.stage('write_in_file'):
+        write_in_file(results, args.output)
+    stats.write()